@@ -0,0 +1,307 @@
+"""Sample pixel values of many points from COGs, reading each block once.
+
+Sampling points one at a time (e.g. with rasterio.sample) makes separate
+reads for every point, band and file. Here the points are grouped by
+the internal block (tile) of each file they fall in, and every block
+that contains at least one point is read once, with all the bands that
+are needed. Blocks are read in a pool of threads with a dataset handle
+per thread and file, and only a bounded number of reads are in flight.
+
+The input can be a list of files or a VRT. A VRT is resolved to its
+source files, so the reads follow the tiling of the COGs and not of the
+VRT.
+
+Pass a range_cache.RangeCache as `opener` (or use --cache_dir) to keep
+the bytes read from remote files in a persistent local cache.
+
+The result is a tidy table with one row per point and band: id, x, y,
+source, value. Use sample_to_parquet() to stream it to a Parquet file
+for large point sets.
+
+Usage:
+
+python block_sampler.py --input /vsigs/spatialthoughts-public-data/terraclimate/soil_moisture.vrt \
+    --points locations.csv --x_column lon --y_column lat --output samples.parquet
+"""
+import argparse
+import concurrent.futures
+import os
+import threading
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import rowcol
+from rasterio.warp import transform as transform_coords
+from rasterio.windows import Window
+
+# Number of blocks read in one task
+BLOCKS_PER_TASK = 64
+
+
+def vrt_sources(vrt_path, opener=None):
+    """Return (label, path, band) of the source of each band of a VRT."""
+    if opener:
+        with opener(vrt_path, 'rb') as f:
+            xml = f.read().decode('utf-8')
+    elif os.path.exists(vrt_path):
+        with open(vrt_path) as f:
+            xml = f.read()
+    else:
+        # e.g. a VRT on /vsigs/
+        from osgeo import gdal
+        xml = gdal.Open(vrt_path).GetMetadata('xml:VRT')[0]
+    root = ET.fromstring(xml)
+    vrt_folder = os.path.dirname(vrt_path)
+    sources = []
+    for band in root.iter('VRTRasterBand'):
+        band_sources = band.findall('./*/SourceFilename')
+        if len(band_sources) != 1:
+            # The sources of a mosaic can be cropped and overlap, which
+            # only the VRT itself resolves
+            raise ValueError('Band {} of {} has {} sources. Mosaic VRTs are not supported, '
+                             'pass the source files instead.'.format(
+                                 band.get('band'), vrt_path, len(band_sources)))
+        source = band_sources[0]
+        path = source.text
+        if source.get('relativeToVRT') == '1':
+            path = vrt_folder + '/' + path
+        source_band = int(band.find('./*/SourceBand').text)
+        description = band.findtext('Description')
+        label = description or os.path.splitext(os.path.basename(path))[0]
+        sources.append((label, path, source_band))
+    return sources
+
+
+def expand_sources(inputs, opener=None):
+    """Return (label, path, band) for every band of the input files.
+
+    inputs is a VRT path or a list of file paths. Files with one band are
+    labelled with their name, other files with their name and band.
+    """
+    if isinstance(inputs, str):
+        if inputs.lower().endswith('.vrt'):
+            return vrt_sources(inputs, opener)
+        inputs = [inputs]
+    sources = []
+    for path in inputs:
+        with rasterio.open(path, opener=opener) if opener else rasterio.open(path) as src:
+            count = src.count
+        name = os.path.splitext(os.path.basename(path))[0]
+        for band in range(1, count + 1):
+            label = name if count == 1 else '{}_b{}'.format(name, band)
+            sources.append((label, path, band))
+    return sources
+
+
+class BlockSampler(object):
+    """Samples points from raster files block by block."""
+
+    def __init__(self, sources, max_workers=16, max_in_flight=None, opener=None):
+        # path -> list of (label, band)
+        self.files = {}
+        for label, path, band in sources:
+            self.files.setdefault(path, []).append((label, band))
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight or max_workers * 2
+        self.opener = opener
+        self.local = threading.local()
+
+    def open(self, path):
+        # Datasets can't be shared between threads
+        if not hasattr(self.local, 'datasets'):
+            self.local.datasets = {}
+        if path not in self.local.datasets:
+            if self.opener:
+                self.local.datasets[path] = rasterio.open(path, opener=self.opener)
+            else:
+                self.local.datasets[path] = rasterio.open(path)
+        return self.local.datasets[path]
+
+    def plan(self, path, xs, ys, crs):
+        """Group the points inside a file by block. Yields lists of
+        (window, point indices, rows, cols) for a task."""
+        src = self.open(path)
+        if crs and src.crs and src.crs != crs:
+            xs, ys = transform_coords(crs, src.crs, xs, ys)
+        rows, cols = rowcol(src.transform, xs, ys)
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+        points = np.flatnonzero(inside)
+        if not len(points):
+            return
+        rows, cols = rows[inside], cols[inside]
+        block_height, block_width = src.block_shapes[0]
+        block_rows = rows // block_height
+        block_cols = cols // block_width
+        # Sort by block, so each block's points are contiguous
+        order = np.lexsort((block_cols, block_rows))
+        points, rows, cols = points[order], rows[order], cols[order]
+        block_rows, block_cols = block_rows[order], block_cols[order]
+        starts = np.flatnonzero(np.r_[True, (np.diff(block_rows) != 0) |
+                                      (np.diff(block_cols) != 0)])
+        ends = np.r_[starts[1:], len(points)]
+
+        task = []
+        for start, end in zip(starts, ends):
+            row_off = int(block_rows[start]) * block_height
+            col_off = int(block_cols[start]) * block_width
+            window = Window(col_off, row_off,
+                            min(block_width, src.width - col_off),
+                            min(block_height, src.height - row_off))
+            task.append((window, points[start:end], rows[start:end] - row_off,
+                         cols[start:end] - col_off))
+            if len(task) >= BLOCKS_PER_TASK:
+                yield task
+                task = []
+        if task:
+            yield task
+
+    def read(self, path, task):
+        """Read the blocks of a task. Returns (point indices, values) with
+        one column of values per band of the file."""
+        src = self.open(path)
+        bands = [band for _, band in self.files[path]]
+        indices = []
+        values = []
+        for window, points, rows, cols in task:
+            data = src.read(bands, window=window, masked=True)
+            block_values = data[:, rows, cols].astype('float64').filled(np.nan)
+            indices.append(points)
+            values.append(block_values.T)
+        return np.concatenate(indices), np.concatenate(values)
+
+    def iter_samples(self, xs, ys, ids=None, crs='EPSG:4326'):
+        """Yield tidy DataFrames (id, x, y, source, value) of sampled
+        values as blocks are read."""
+        xs = np.asarray(xs, dtype='float64')
+        ys = np.asarray(ys, dtype='float64')
+        ids = np.arange(len(xs)) if ids is None else np.asarray(ids)
+
+        def tasks():
+            # Files on the same grid, e.g. monthly COGs, share the plan
+            plans = {}
+            for path in self.files:
+                src = self.open(path)
+                grid = (str(src.crs), tuple(src.transform), src.width, src.height,
+                        src.block_shapes[0])
+                if grid not in plans:
+                    plans[grid] = list(self.plan(path, xs, ys, crs))
+                for task in plans[grid]:
+                    yield path, task
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        in_flight = {}
+        pending = tasks()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(in_flight) < self.max_in_flight:
+                    item = next(pending, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    path, task = item
+                    in_flight[executor.submit(self.read, path, task)] = path
+                if not in_flight:
+                    break
+                done, _ = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    path = in_flight.pop(future)
+                    points, values = future.result()
+                    labels = [label for label, _ in self.files[path]]
+                    yield pd.DataFrame({
+                        'id': np.repeat(ids[points], len(labels)),
+                        'x': np.repeat(xs[points], len(labels)),
+                        'y': np.repeat(ys[points], len(labels)),
+                        'source': np.tile(labels, len(points)),
+                        'value': values.ravel(),
+                    })
+        finally:
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+def sample_points(inputs, xs, ys, ids=None, crs='EPSG:4326', max_workers=16,
+                  opener=None):
+    """Return a tidy DataFrame (id, x, y, source, value) of the values of
+    all bands of `inputs` (a VRT or a list of files) at the points."""
+    sampler = BlockSampler(expand_sources(inputs, opener), max_workers, opener=opener)
+    frames = list(sampler.iter_samples(xs, ys, ids, crs))
+    if not frames:
+        return pd.DataFrame(columns=['id', 'x', 'y', 'source', 'value'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def sample_to_parquet(inputs, xs, ys, output, ids=None, crs='EPSG:4326',
+                      max_workers=16, opener=None, row_group_size=1000000):
+    """Stream the samples to a Parquet file. Returns the number of rows."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    sampler = BlockSampler(expand_sources(inputs, opener), max_workers, opener=opener)
+    # The schema is fixed up front, so every row group has the same types
+    ids = np.arange(len(xs)) if ids is None else np.asarray(ids)
+    id_type = pa.string() if ids.dtype == object else pa.from_numpy_dtype(ids.dtype)
+    schema = pa.schema([('id', id_type), ('x', pa.float64()), ('y', pa.float64()),
+                        ('source', pa.string()), ('value', pa.float64())])
+    writer = pq.ParquetWriter(output, schema)
+    buffer = []
+    buffered = 0
+    rows = 0
+    try:
+        for frame in sampler.iter_samples(xs, ys, ids, crs):
+            buffer.append(frame)
+            buffered += len(frame)
+            if buffered >= row_group_size:
+                table = pa.Table.from_pandas(pd.concat(buffer, ignore_index=True),
+                                             schema=schema, preserve_index=False)
+                writer.write_table(table)
+                rows += buffered
+                buffer, buffered = [], 0
+        if buffer:
+            table = pa.Table.from_pandas(pd.concat(buffer, ignore_index=True),
+                                         schema=schema, preserve_index=False)
+            writer.write_table(table)
+            rows += buffered
+    finally:
+        writer.close()
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', help='VRT or raster files to sample', nargs='+', required=True)
+    parser.add_argument('--points', help='CSV file with the points', required=True)
+    parser.add_argument('--id_column', help='column with the point ids')
+    parser.add_argument('--x_column', help='column with the x coordinates', default='x')
+    parser.add_argument('--y_column', help='column with the y coordinates', default='y')
+    parser.add_argument('--crs', help='CRS of the points', default='EPSG:4326')
+    parser.add_argument('--output', help='output Parquet or CSV file', default='samples.parquet')
+    parser.add_argument('--workers', help='number of concurrent reads', type=int, default=16)
+    parser.add_argument('--cache_dir', help='folder for a persistent cache of remote reads')
+    parser.add_argument('--cache_size', help='maximum size of the cache in GB',
+                        type=float, default=10)
+    args = parser.parse_args()
+
+    os.environ.setdefault('GS_NO_SIGN_REQUEST', 'YES')
+    opener = None
+    if args.cache_dir:
+        from range_cache import RangeCache
+        opener = RangeCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 ** 3),
+                            pool_size=args.workers)
+    points = pd.read_csv(args.points)
+    ids = points[args.id_column] if args.id_column else None
+    inputs = args.input[0] if len(args.input) == 1 else args.input
+    if args.output.endswith('.parquet'):
+        rows = sample_to_parquet(inputs, points[args.x_column], points[args.y_column],
+                                 args.output, ids=ids, crs=args.crs, max_workers=args.workers,
+                                 opener=opener)
+    else:
+        df = sample_points(inputs, points[args.x_column], points[args.y_column],
+                           ids=ids, crs=args.crs, max_workers=args.workers,
+                           opener=opener)
+        df.to_csv(args.output, index=False)
+        rows = len(df)
+    print('Written {} samples to {}'.format(rows, args.output))
@@ -0,0 +1,286 @@
+"""Persistent local cache of byte ranges read from remote COGs.
+
+GDAL keeps downloaded ranges in memory only for the life of a process,
+so every run of a script fetches the same COG headers and tiles again.
+This module serves rasterio reads of remote files through a cache on
+disk instead:
+
+- Files are read in aligned blocks (1 MB by default). Each block is
+  stored as a file and indexed in SQLite by (url, etag, start, end), so
+  a file that changes on the server is never served from old blocks.
+- Missing blocks that are next to each other in one read are fetched
+  with a single HTTP range request.
+- The cache is limited to `max_bytes`. The least recently used blocks
+  are deleted first. The total size is read from SQLite on every
+  eviction, so several processes can share one cache folder.
+
+Pass a RangeCache as the opener to rasterio.open() (rasterio 1.4 or
+newer), or to the block_sampler functions:
+
+    cache = RangeCache('cog_cache', max_bytes=20 * 1024 ** 3)
+    with rasterio.open('/vsigs/bucket/image.tif', opener=cache) as src:
+        ...
+
+/vsigs/, gs://, /vsis3/, s3:// and /vsicurl/ paths are mapped to public
+HTTPS URLs, so only public buckets are supported.
+"""
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+BLOCK_SIZE = 1024 * 1024
+MAX_BYTES = 10 * 1024 ** 3
+
+
+def http_url(path):
+    """Return the HTTPS URL of a cloud storage path."""
+    for prefix in ['/vsigs/', 'gs://']:
+        if path.startswith(prefix):
+            return 'https://storage.googleapis.com/' + path[len(prefix):]
+    for prefix in ['/vsis3/', 's3://']:
+        if path.startswith(prefix):
+            bucket, key = path[len(prefix):].split('/', 1)
+            return 'https://{}.s3.amazonaws.com/{}'.format(bucket, key)
+    if path.startswith('/vsicurl/'):
+        return path[len('/vsicurl/'):]
+    return path
+
+
+class RangeCache(object):
+    """Disk cache of blocks of remote files, shared between threads."""
+
+    def __init__(self, cache_dir, max_bytes=MAX_BYTES, block_size=BLOCK_SIZE,
+                 pool_size=32, timeout=60):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.timeout = timeout
+        self.block_dir = os.path.join(cache_dir, 'blocks')
+        if not os.path.exists(self.block_dir):
+            os.makedirs(self.block_dir)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.lock = threading.Lock()
+        # Autocommit with a write-ahead log, so updating access times is
+        # cheap and other processes can use the same cache
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'blocks.sqlite'),
+                                  check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS blocks (url TEXT, etag TEXT, '
+                        'start INTEGER, end INTEGER, name TEXT, size INTEGER, '
+                        'accessed REAL, PRIMARY KEY (url, etag, start, end))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS blocks_accessed ON blocks (accessed)')
+        self.total_bytes = 0
+        # The limit may be lower than in a previous run
+        with self.lock:
+            self.evict()
+        # url -> (size, etag), checked once per process
+        self.heads = {}
+        self.requests = 0
+        self.hits = 0
+
+    def __call__(self, path, mode='rb'):
+        """Open `path` for reading, as an opener for rasterio.open()."""
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('RangeCache only supports reading')
+        url = http_url(path)
+        if not url.startswith(('https://', 'http://')):
+            raise FileNotFoundError(path)
+        size, etag = self.head(url)
+        return CachedFile(self, url, size, etag)
+
+    def close(self):
+        self.session.close()
+        self.db.close()
+
+    def head(self, url):
+        if url not in self.heads:
+            response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+            self.requests += 1
+            if response.status_code in (403, 404):
+                # GDAL looks for sidecar files (.aux.xml, .ovr, ...) that
+                # usually don't exist, remember them so they are not
+                # requested again
+                self.heads[url] = None
+            else:
+                response.raise_for_status()
+                size = int(response.headers['Content-Length'])
+                # Without an ETag, the modification time identifies the version
+                etag = response.headers.get('ETag') or response.headers.get('Last-Modified', '')
+                self.heads[url] = (size, etag)
+        if self.heads[url] is None:
+            raise FileNotFoundError(url)
+        return self.heads[url]
+
+    def block_path(self, name):
+        return os.path.join(self.block_dir, name[:2], name)
+
+    def get(self, url, etag, start, end):
+        with self.lock:
+            row = self.db.execute('SELECT name FROM blocks WHERE url = ? AND etag = ? '
+                                  'AND start = ? AND end = ?',
+                                  (url, etag, start, end)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE blocks SET accessed = ? WHERE url = ? AND etag = ? '
+                            'AND start = ? AND end = ?',
+                            (time.time(), url, etag, start, end))
+        try:
+            with open(self.block_path(row[0]), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, url, etag, start, end, data):
+        name = hashlib.sha1('{}|{}|{}|{}'.format(url, etag, start, end).encode(
+            'utf-8')).hexdigest()
+        path = self.block_path(name)
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (url, etag, start, end, name, len(data), time.time()))
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used blocks until the cache fits. Must be
+        called with the lock held.
+
+        Other processes may add or delete blocks too, so the total size
+        is read from the database in a write transaction.
+        """
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.total_bytes = self.db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM blocks').fetchone()[0]
+            removed = []
+            while self.total_bytes > self.max_bytes:
+                rows = self.db.execute('SELECT url, etag, start, end, name, size FROM blocks '
+                                       'ORDER BY accessed LIMIT 100').fetchall()
+                if not rows:
+                    break
+                for url, etag, start, end, name, size in rows:
+                    self.db.execute('DELETE FROM blocks WHERE url = ? AND etag = ? '
+                                    'AND start = ? AND end = ?', (url, etag, start, end))
+                    removed.append(name)
+                    self.total_bytes -= size
+                    if self.total_bytes <= self.max_bytes:
+                        break
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        # Block files are only deleted once their rows are gone
+        for name in removed:
+            try:
+                os.remove(self.block_path(name))
+            except FileNotFoundError:
+                pass
+
+    def fetch(self, url, etag, start, end):
+        """Fetch bytes [start, end) with a single range request."""
+        response = self.session.get(url, headers={'Range': 'bytes={}-{}'.format(
+            start, end - 1)}, timeout=self.timeout)
+        response.raise_for_status()
+        self.requests += 1
+        if response.status_code != 206:
+            # The server ignored the range and returned the whole file
+            return response.content[start:end]
+        return response.content
+
+    def read(self, url, size, etag, start, end):
+        """Return bytes [start, end) of a file, from the cache where possible."""
+        end = min(end, size)
+        if start >= end:
+            return b''
+        first = start // self.block_size
+        last = (end - 1) // self.block_size
+        blocks = {}
+        missing = []
+        for index in range(first, last + 1):
+            block_start = index * self.block_size
+            block_end = min(block_start + self.block_size, size)
+            data = self.get(url, etag, block_start, block_end)
+            if data is None:
+                missing.append(index)
+            else:
+                blocks[index] = data
+
+        # Fetch each run of adjacent missing blocks with one request
+        runs = []
+        for index in missing:
+            if runs and runs[-1][-1] == index - 1:
+                runs[-1].append(index)
+            else:
+                runs.append([index])
+        for run in runs:
+            run_start = run[0] * self.block_size
+            run_end = min((run[-1] + 1) * self.block_size, size)
+            data = self.fetch(url, etag, run_start, run_end)
+            for index in run:
+                offset = index * self.block_size - run_start
+                block = data[offset:offset + self.block_size]
+                blocks[index] = block
+                self.put(url, etag, index * self.block_size,
+                         index * self.block_size + len(block), block)
+
+        data = b''.join(blocks[index] for index in range(first, last + 1))
+        offset = start - first * self.block_size
+        return data[offset:offset + end - start]
+
+
+class CachedFile(io.RawIOBase):
+    """Read-only file object of a remote file, read through a RangeCache."""
+
+    def __init__(self, cache, url, size, etag):
+        self.cache = cache
+        self.url = url
+        self.size = size
+        self.etag = etag
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else self.position + size
+        data = self.cache.read(self.url, self.size, self.etag, self.position, end)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
@@ -0,0 +1,181 @@
+"""Tests for range_cache.py against a local HTTP server with Range
+support standing in for a cloud storage bucket.
+
+Run with: python -m pytest test_range_cache.py
+"""
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from range_cache import RangeCache
+
+BLOCK_SIZE = 1024
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves server.files (path -> bytes) with HEAD, ETag and single
+    byte range requests, and records every request."""
+
+    def send_file_headers(self, content, length):
+        self.send_header('Content-Length', str(length))
+        self.send_header('ETag', '"{}"'.format(self.server.etag))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.server.log.append(('HEAD', self.path, None))
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_file_headers(content, len(content))
+
+    def do_GET(self):
+        header = self.headers.get('Range')
+        self.server.log.append(('GET', self.path, header))
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        match = re.match(r'bytes=(\d+)-(\d+)', header or '')
+        if match is None:
+            self.send_response(200)
+            self.send_file_headers(content, len(content))
+            self.wfile.write(content)
+            return
+        start, end = int(match.group(1)), min(int(match.group(2)), len(content) - 1)
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(content)))
+        self.send_file_headers(content, end - start + 1)
+        self.wfile.write(content[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+class RangeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        self.server.files = {'/bucket/image.tif': os.urandom(20 * BLOCK_SIZE + 100)}
+        self.server.etag = 'v1'
+        self.server.log = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://{}:{}/bucket/image.tif'.format(*self.server.server_address)
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def new_cache(self, **kwargs):
+        kwargs.setdefault('block_size', BLOCK_SIZE)
+        return RangeCache(self.cache_dir, **kwargs)
+
+    def range_requests(self):
+        return [entry for entry in self.server.log if entry[0] == 'GET']
+
+    def read(self, cache, start, size, url=None):
+        with cache(url or self.url) as f:
+            f.seek(start)
+            return f.read(size)
+
+    def test_reads_are_byte_exact(self):
+        content = self.server.files['/bucket/image.tif']
+        cache = self.new_cache()
+        for start, size in [(0, 10), (1000, 100), (BLOCK_SIZE - 1, 2), (3000, 5 * BLOCK_SIZE),
+                            (len(content) - 50, 1000), (len(content) + 10, 10)]:
+            self.assertEqual(self.read(cache, start, size), content[start:start + size])
+        with cache(self.url) as f:
+            self.assertEqual(f.read(), content)
+            f.seek(-100, os.SEEK_END)
+            buffer = bytearray(100)
+            self.assertEqual(f.readinto(buffer), 100)
+            self.assertEqual(bytes(buffer), content[-100:])
+        cache.close()
+
+    def test_second_pass_makes_no_range_requests(self):
+        reads = [(0, 500), (5 * BLOCK_SIZE + 10, 3 * BLOCK_SIZE), (15 * BLOCK_SIZE, 100)]
+        cache = self.new_cache()
+        first = [self.read(cache, start, size) for start, size in reads]
+        cache.close()
+        fetched = len(self.range_requests())
+        self.assertGreater(fetched, 0)
+        # A new cache on the same folder, like the next run of a script
+        cache = self.new_cache()
+        second = [self.read(cache, start, size) for start, size in reads]
+        cache.close()
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.range_requests()), fetched)
+
+    def test_eviction_at_max_bytes(self):
+        cache = self.new_cache(max_bytes=4 * BLOCK_SIZE)
+        for index in range(10):
+            self.read(cache, index * BLOCK_SIZE, 10)
+            self.assertLessEqual(cache.total_bytes, 4 * BLOCK_SIZE)
+        rows = cache.db.execute('SELECT start FROM blocks ORDER BY start').fetchall()
+        # The least recently used blocks were deleted
+        self.assertEqual([row[0] for row in rows], [i * BLOCK_SIZE for i in range(6, 10)])
+        files = [name for _, _, names in os.walk(cache.block_dir) for name in names]
+        self.assertEqual(len(files), 4)
+        cache.close()
+        # A lower limit is applied when the cache is opened again
+        cache = self.new_cache(max_bytes=2 * BLOCK_SIZE)
+        self.assertLessEqual(cache.total_bytes, 2 * BLOCK_SIZE)
+        cache.close()
+
+    def test_eviction_with_shared_folder(self):
+        # Two caches on one folder, like two processes running at once
+        first = self.new_cache(max_bytes=4 * BLOCK_SIZE)
+        second = self.new_cache(max_bytes=4 * BLOCK_SIZE)
+        for index in range(10):
+            cache = first if index % 2 else second
+            self.read(cache, index * BLOCK_SIZE, 10)
+            total = cache.db.execute('SELECT SUM(size) FROM blocks').fetchone()[0]
+            self.assertLessEqual(total, 4 * BLOCK_SIZE)
+        files = [name for _, _, names in os.walk(first.block_dir) for name in names]
+        self.assertEqual(len(files), 4)
+        first.close()
+        second.close()
+
+    def test_adjacent_missing_blocks_are_coalesced(self):
+        cache = self.new_cache()
+        self.read(cache, 3 * BLOCK_SIZE, 10)
+        before = len(self.range_requests())
+        # Blocks 0-2 and 4-9 are missing, block 3 is cached
+        self.read(cache, 0, 10 * BLOCK_SIZE)
+        requests = self.range_requests()[before:]
+        self.assertEqual([header for _, _, header in requests],
+                         ['bytes=0-{}'.format(3 * BLOCK_SIZE - 1),
+                          'bytes={}-{}'.format(4 * BLOCK_SIZE, 10 * BLOCK_SIZE - 1)])
+        cache.close()
+
+    def test_etag_change_invalidates_blocks(self):
+        cache = self.new_cache()
+        self.read(cache, 0, 100)
+        cache.close()
+        self.server.files['/bucket/image.tif'] = os.urandom(20 * BLOCK_SIZE)
+        self.server.etag = 'v2'
+        before = len(self.range_requests())
+        cache = self.new_cache()
+        self.assertEqual(self.read(cache, 0, 100), self.server.files['/bucket/image.tif'][:100])
+        self.assertEqual(len(self.range_requests()), before + 1)
+        cache.close()
+
+    def test_missing_files_are_remembered(self):
+        cache = self.new_cache()
+        for _ in range(3):
+            with self.assertRaises(FileNotFoundError):
+                cache(self.url + '.aux.xml')
+        heads = [entry for entry in self.server.log if entry[0] == 'HEAD']
+        self.assertEqual(len(heads), 1)
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
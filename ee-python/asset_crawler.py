@@ -0,0 +1,108 @@
+"""Shared helpers to crawl an Earth Engine asset tree.
+
+The asset tree is walked breadth-first. Each listing page is fetched
+on a thread pool, with at most `max_workers` requests in flight at a
+time, and every page of a folder or collection is followed using
+`nextPageToken`. Assets are yielded as they arrive so the full list
+never has to be held in memory.
+
+Usage:
+
+from asset_crawler import crawl_assets
+
+for asset in crawl_assets('projects/spatialthoughts/assets/temp'):
+    print(asset['name'], asset['type'])
+"""
+import collections
+import concurrent.futures
+import ee
+from bulk_requests import call_with_retry
+
+CONTAINER_TYPES = ('FOLDER', 'IMAGE_COLLECTION')
+
+# Maximum page size accepted by ee.data.listAssets
+PAGE_SIZE = 1000
+
+
+def is_container(asset):
+    return asset['type'] in CONTAINER_TYPES
+
+
+def list_page(parent, page_token=None, page_size=PAGE_SIZE, data=None):
+    """Fetch a single page of children of a folder or collection.
+
+    Returns a tuple of (assets, next_page_token). The token is None
+    when this was the last page. Quota errors are retried.
+    """
+    data = data or ee.data
+    params = {'parent': parent, 'pageSize': page_size}
+    if page_token:
+        params['pageToken'] = page_token
+    response = call_with_retry(data.listAssets, params)
+    return response.get('assets', []), response.get('nextPageToken')
+
+
+def list_children(parent, page_size=PAGE_SIZE, data=None):
+    """Yield all direct children of a folder or collection, following
+    every listing page."""
+    page_token = None
+    while True:
+        assets, page_token = list_page(parent, page_token, page_size, data)
+        for asset in assets:
+            yield asset
+        if not page_token:
+            break
+
+
+def crawl_assets(parent, max_workers=8, page_size=PAGE_SIZE,
+                 include_containers=False, data=None):
+    """Recursively yield all assets under `parent`.
+
+    Args:
+      parent: Path to any asset folder, collection or asset.
+      max_workers: Maximum number of listing requests in flight.
+      page_size: Number of assets requested per listing page.
+      include_containers: Also yield the folders and collections
+        found while crawling (the root itself is never yielded).
+      data: Module implementing the ee.data API. Defaults to ee.data.
+
+    Yields:
+      Asset records as returned by ee.data.listAssets, in no
+      particular order.
+    """
+    data = data or ee.data
+    root = call_with_retry(data.getAsset, parent)
+    if not is_container(root):
+        yield root
+        return
+
+    # Each pending item is a (container, page_token) pair
+    pending = collections.deque([(root['name'], None)])
+    # Maps each in-flight request to the container it is listing
+    in_flight = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < max_workers:
+                container, page_token = pending.popleft()
+                future = executor.submit(
+                    list_page, container, page_token, page_size, data)
+                in_flight[future] = container
+            done, _ = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                container = in_flight.pop(future)
+                assets, next_page_token = future.result()
+                if next_page_token:
+                    pending.append((container, next_page_token))
+                for asset in assets:
+                    if is_container(asset):
+                        pending.append((asset['name'], None))
+                        if include_containers:
+                            yield asset
+                    else:
+                        yield asset
+    finally:
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=True)
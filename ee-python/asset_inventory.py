@@ -0,0 +1,241 @@
+"""A persistent local inventory of an Earth Engine asset tree.
+
+The inventory is a SQLite database holding the id, type, size,
+updateTime and parent of every asset below the folders that were
+synced. A refresh lists the root folder and then only descends into
+folders and collections whose updateTime changed since the last sync,
+so refreshing an unchanged tree takes a handful of requests.
+
+This relies on a change deep in the tree giving all the folders above
+it a new updateTime. If that is not the case for your assets, use
+refresh(..., full=True), which lists every folder and collection and
+still skips the lookups of unchanged images.
+
+Assets read from the inventory have the same keys as the records
+returned by ee.data.listAssets, so they can be used anywhere the
+output of asset_crawler.crawl_assets is expected.
+
+Usage:
+
+from asset_inventory import AssetInventory
+
+inventory = AssetInventory('assets.sqlite')
+inventory.refresh('projects/spatialthoughts/assets/temp')
+for asset in inventory.iter_assets('projects/spatialthoughts/assets/temp'):
+    print(asset['name'], asset['sizeBytes'])
+inventory.close()
+"""
+import collections
+import concurrent.futures
+import sqlite3
+import ee
+from asset_crawler import (CONTAINER_TYPES, PAGE_SIZE, crawl_assets,
+                           is_container, list_page)
+from bulk_requests import call_with_retry
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS assets (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    size_bytes INTEGER,
+    update_time TEXT,
+    parent TEXT
+);
+CREATE INDEX IF NOT EXISTS assets_parent ON assets (parent);
+'''
+
+
+def parent_of(name):
+    return name.rsplit('/', 1)[0]
+
+
+def subtree_bounds(name):
+    """Return the (low, high) id range of all assets below `name`.
+
+    '0' is the character right after '/', so every descendant id sorts
+    between name + '/' and name + '0'.
+    """
+    return name + '/', name + '0'
+
+
+class AssetInventory(object):
+    """SQLite backed inventory of one or more asset trees."""
+
+    def __init__(self, path, data=None):
+        self.data = data or ee.data
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _get(self, name):
+        return self.connection.execute(
+            'SELECT type, size_bytes, update_time FROM assets WHERE id = ?',
+            (name,)).fetchone()
+
+    def _children(self, name):
+        rows = self.connection.execute(
+            'SELECT id FROM assets WHERE parent = ?', (name,))
+        return set(row[0] for row in rows)
+
+    def _upsert(self, asset):
+        size = asset.get('sizeBytes')
+        self.connection.execute(
+            'INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?)',
+            (asset['name'], asset['type'],
+             int(size) if size is not None else None,
+             asset.get('updateTime'), parent_of(asset['name'])))
+
+    def _delete(self, name):
+        low, high = subtree_bounds(name)
+        self.connection.execute(
+            'DELETE FROM assets WHERE id = ? OR (id >= ? AND id < ?)',
+            (name, low, high))
+
+    def refresh(self, parent, max_workers=8, page_size=PAGE_SIZE, full=False):
+        """Bring the inventory of `parent` up to date.
+
+        The root is always listed. Child folders and collections are
+        only listed when they are new or their updateTime changed, or
+        always with full=True. Images and tables that are new or
+        changed, and whose listing has no size, are looked up with
+        ee.data.getAsset.
+
+        Returns the number of requests made, counting every listing
+        page.
+        """
+        data = self.data
+
+        def list_all(name):
+            """Return (children, number of pages) of a container."""
+            children = []
+            pages = 0
+            page_token = None
+            while True:
+                assets, page_token = list_page(name, page_token, page_size, data)
+                children.extend(assets)
+                pages += 1
+                if not page_token:
+                    return children, pages
+
+        root = call_with_retry(data.getAsset, parent)
+        if not is_container(root):
+            self._upsert(root)
+            self.connection.commit()
+            return 1
+
+        requests = 1
+        pending = collections.deque([('list', root)])
+        # Maps each in-flight request to its (kind, asset record)
+        in_flight = {}
+        # Number of unfinished requests below each container that is
+        # being refreshed. A container's own record (and its updateTime)
+        # is only stored once its whole subtree is up to date, so an
+        # interrupted refresh descends into it again.
+        remaining = {}
+        containers = {}
+
+        def finish(name):
+            while name in remaining:
+                remaining[name] -= 1
+                if remaining[name]:
+                    break
+                del remaining[name]
+                self._upsert(containers.pop(name))
+                name = parent_of(name)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or in_flight:
+                while pending and len(in_flight) < max_workers:
+                    kind, asset = pending.popleft()
+                    if kind == 'list':
+                        future = executor.submit(list_all, asset['name'])
+                    else:
+                        future = executor.submit(
+                            call_with_retry, data.getAsset, asset['name'])
+                        requests += 1
+                    in_flight[future] = (kind, asset)
+                done, _ = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    kind, asset = in_flight.pop(future)
+                    if kind == 'asset':
+                        self._upsert(future.result())
+                        finish(parent_of(asset['name']))
+                        continue
+                    children, pages = future.result()
+                    requests += pages
+                    queued = len(pending)
+                    stale = self._children(asset['name'])
+                    for child in children:
+                        stale.discard(child['name'])
+                        cached = self._get(child['name'])
+                        if full and is_container(child):
+                            pending.append(('list', child))
+                        elif cached is None or cached[2] != child.get('updateTime'):
+                            if is_container(child):
+                                pending.append(('list', child))
+                            elif 'sizeBytes' not in child:
+                                pending.append(('asset', child))
+                            else:
+                                self._upsert(child)
+                        elif not is_container(child) and cached[1] is None:
+                            pending.append(('asset', child))
+                    for name in stale:
+                        self._delete(name)
+                    # One more for the listing itself, which is done now
+                    remaining[asset['name']] = len(pending) - queued + 1
+                    containers[asset['name']] = asset
+                    finish(asset['name'])
+                self.connection.commit()
+        return requests
+
+    def iter_assets(self, parent, include_containers=False):
+        """Yield the cached assets below `parent`, like crawl_assets."""
+        low, high = subtree_bounds(parent)
+        query = ('SELECT id, type, size_bytes, update_time FROM assets '
+                 'WHERE id >= ? AND id < ?')
+        params = [low, high]
+        if not include_containers:
+            query += ' AND type NOT IN ({})'.format(
+                ', '.join('?' for _ in CONTAINER_TYPES))
+            params.extend(CONTAINER_TYPES)
+        for name, asset_type, size, update_time in self.connection.execute(
+                query, params):
+            asset = {'name': name, 'id': name, 'type': asset_type,
+                     'updateTime': update_time}
+            if size is not None:
+                asset['sizeBytes'] = str(size)
+            yield asset
+
+
+def iter_tree(parent, inventory_path=None, max_workers=8,
+              include_containers=False, data=None):
+    """Yield all assets below `parent`, or `parent` itself if it is not
+    a folder or collection.
+
+    Without an inventory this is the same as crawl_assets. With an
+    inventory path, the inventory is refreshed first and the assets
+    are then read from it.
+    """
+    if inventory_path is None:
+        for asset in crawl_assets(parent, max_workers=max_workers,
+                                  include_containers=include_containers,
+                                  data=data):
+            yield asset
+        return
+    with AssetInventory(inventory_path, data=data) as inventory:
+        inventory.refresh(parent, max_workers=max_workers)
+        root = call_with_retry(inventory.data.getAsset, parent)
+        if not is_container(root):
+            yield root
+            return
+        for asset in inventory.iter_assets(root['name'], include_containers):
+            yield asset
@@ -1,6 +1,16 @@
 """This script queries your Asset folder and generates a CSV file
 with the size and type of each asset.
 
+Size and type are read from the listing metadata returned while
+crawling the folder. Assets whose listing does not include a size are
+looked up with ee.data.getAsset in concurrent batches. Rows are
+written to the output file as they arrive.
+
+Two more files are written next to the output file:
+- <output>_rollups.csv: Total size and asset count of every folder and
+  collection, including all assets below it.
+- <output>_top.csv: The --top_k largest assets, largest first.
+
 Usage:
 
 python asset_size.py --asset_folder <path to any asset folder> --output_file output.csv
@@ -11,69 +21,173 @@ python asset_size.py \
     --output_file output.csv
 """
 import argparse
-import ee
+import collections
+import concurrent.futures
 import csv
+import heapq
+import os
+import ee
+import ee_instrument
+from asset_crawler import is_container
+from asset_inventory import iter_tree
+from bulk_requests import call_with_retry
+
+
+def to_mb(size):
+    return round(int(size)/1e6, 2)
+
+
+def fill_missing_sizes(assets, max_workers=8, batch_size=100, data=None):
+    """Yield assets with 'sizeBytes' set.
+
+    Assets that already carry a size in their listing metadata are
+    passed through. The rest are buffered and fetched with
+    ee.data.getAsset in concurrent batches of `batch_size`.
+    """
+    data = data or ee.data
+    missing = []
+
+    def get_asset(name):
+        return call_with_retry(data.getAsset, name)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for asset in assets:
+            if is_container(asset) or 'sizeBytes' in asset:
+                yield asset
+                continue
+            missing.append(asset['name'])
+            if len(missing) >= batch_size:
+                for info in executor.map(get_asset, missing):
+                    yield info
+                missing = []
+        for info in executor.map(get_asset, missing):
+            yield info
+
+
+def parent_of(name):
+    return name.rsplit('/', 1)[0]
+
+
+def write_report(parent, output_file, top_k=100, max_workers=8,
+                 batch_size=100, inventory_path=None, data=None):
+    """Crawl `parent` and write the size report files.
+
+    If `inventory_path` is given, the assets are read from the local
+    inventory after refreshing it instead of crawling the whole tree.
+
+    Returns a tuple of (number of assets, total size in bytes).
+    """
+    data = data or ee.data
+    root_asset = call_with_retry(data.getAsset, parent)
+    root = root_asset['name']
+    stem = os.path.splitext(output_file)[0]
+    rollup_file = '{}_rollups.csv'.format(stem)
+    top_file = '{}_top.csv'.format(stem)
+
+    container_types = {root: root_asset['type']}
+    # Per container: [asset_count, size_bytes], including all descendants
+    rollups = collections.defaultdict(lambda: [0, 0])
+    # Min-heap holding the top_k largest assets seen so far
+    largest = []
+    count = 0
+    total = 0
+
+    assets = iter_tree(root, inventory_path=inventory_path,
+                       max_workers=max_workers, include_containers=True,
+                       data=data)
+    fieldnames = ['asset', 'type', 'size_mb']
+    with open(output_file, mode='w', newline='') as f:
+        csv_writer = csv.DictWriter(f, fieldnames=fieldnames)
+        csv_writer.writeheader()
+        for info in fill_missing_sizes(assets, max_workers, batch_size, data):
+            name = info['name']
+            if is_container(info):
+                container_types[name] = info['type']
+                continue
+            asset_type = info['type']
+            size = int(info.get('sizeBytes', 0))
+            csv_writer.writerow({
+                'asset': name,
+                'type': asset_type,
+                'size_mb': to_mb(size)
+            })
+            count += 1
+            total += size
+
+            # Add the size to every container up to the root folder
+            container = parent_of(name)
+            while container == root or container.startswith(root + '/'):
+                rollups[container][0] += 1
+                rollups[container][1] += size
+                container = parent_of(container)
+
+            item = (size, name, asset_type)
+            if len(largest) < top_k:
+                heapq.heappush(largest, item)
+            elif item > largest[0]:
+                heapq.heapreplace(largest, item)
+
+    fieldnames = ['container', 'type', 'asset_count', 'size_mb']
+    with open(rollup_file, mode='w', newline='') as f:
+        csv_writer = csv.DictWriter(f, fieldnames=fieldnames)
+        csv_writer.writeheader()
+        for container in sorted(rollups):
+            asset_count, size = rollups[container]
+            csv_writer.writerow({
+                'container': container,
+                'type': container_types.get(container, ''),
+                'asset_count': asset_count,
+                'size_mb': to_mb(size)
+            })
+
+    fieldnames = ['rank', 'asset', 'type', 'size_mb']
+    with open(top_file, mode='w', newline='') as f:
+        csv_writer = csv.DictWriter(f, fieldnames=fieldnames)
+        csv_writer.writeheader()
+        ranked = sorted(largest, reverse=True)
+        for rank, (size, name, asset_type) in enumerate(ranked, start=1):
+            csv_writer.writerow({
+                'rank': rank,
+                'asset': name,
+                'type': asset_type,
+                'size_mb': to_mb(size)
+            })
+
+    return count, total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage='python asset_size.py <path to asset folder> <output_file>')
+    parser.add_argument('--asset_folder', help='full path to the asset folder')
+    parser.add_argument('--output_file', help='output file to write')
+    parser.add_argument('--max_workers', help='number of concurrent requests',
+                        type=int, default=8)
+    parser.add_argument('--batch_size', help='number of assets per metadata batch',
+                        type=int, default=100)
+    parser.add_argument('--top_k', help='number of largest assets to report',
+                        type=int, default=100)
+    parser.add_argument('--inventory', help='path to a local SQLite asset inventory to '
+                        'refresh and read instead of crawling the whole folder')
+    ee_instrument.add_arguments(parser)
+
+    args = parser.parse_args()
+    parent = args.asset_folder
+
+    # Replace the cloud_project with your own project
+    cloud_project = 'spatialthoughts'
+
+    try:
+        ee.Initialize(project=cloud_project)
+    except:
+        ee.Authenticate()
+        ee.Initialize(project=cloud_project)
+
+    ee_instrument.enable_from_args(args)
+
+    count, total = write_report(
+        parent, args.output_file, top_k=args.top_k,
+        max_workers=args.max_workers, batch_size=args.batch_size,
+        inventory_path=args.inventory)
 
-parser = argparse.ArgumentParser(usage='python asset_size.py <path to asset folder> <output_file>')
-parser.add_argument('--asset_folder', help='full path to the asset folder')
-parser.add_argument('--output_file', help='output file to write')
-
-args = parser.parse_args()
-parent = args.asset_folder
-
-# Replace the cloud_project with your own project
-cloud_project = 'spatialthoughts'
-
-try:
-    ee.Initialize(project=cloud_project)
-except:
-    ee.Authenticate()
-    ee.Initialize(project=cloud_project)
-
-def get_asset_list(parent):
-    parent_asset = ee.data.getAsset(parent)
-    parent_id = parent_asset['name']
-    parent_type = parent_asset['type']
-    asset_list = []
-    child_assets = ee.data.listAssets({'parent': parent_id})['assets']
-    for child_asset in child_assets:
-        child_id = child_asset['name']
-        child_type = child_asset['type']
-        if child_type in ['FOLDER','IMAGE_COLLECTION']:
-            # Recursively call the function to get child assets
-            asset_list.extend(get_asset_list(child_id))
-        else:
-            asset_list.append(child_id)
-    return asset_list
-    
-all_assets = get_asset_list(parent)
-
-print('Found {} assets'.format(len(all_assets)))
-
-data = []
-
-for asset in all_assets:
-    print('Processing {}'.format(asset))
-    info = ee.data.getAsset(asset)
-    asset_type = info['type']
-    size = info['sizeBytes']
-    size_mb = round(int(size)/1e6, 2)
-    data.append({
-        'asset': asset, 
-        'type': asset_type,
-        'size_mb': size_mb
-    })
-    
-
-# Sort the assets by size
-sorted_data = sorted(data, key=lambda d: d['size_mb'], reverse=True)
-
-# Write the data to a file
-fieldnames = ['asset', 'type', 'size_mb']
-with open(args.output_file, mode='w') as output_file:
-    csv_writer = csv.DictWriter(output_file, fieldnames=fieldnames)
-    csv_writer.writeheader()
-    for row in sorted_data:
-        csv_writer.writerow(row)
-        
-print('Successfully written output file at {}'.format(args.output_file))
+    print('Found {} assets with a total size of {} MB'.format(count, to_mb(total)))
+    print('Successfully written output file at {}'.format(args.output_file))
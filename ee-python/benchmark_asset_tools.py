@@ -0,0 +1,150 @@
+"""Benchmark the asset scripts against an in-process fake of ee.data.
+
+For each tree size, a synthetic asset tree is built with
+fake_ee_data.FakeEEData and each tool is run against it:
+
+- list: asset_crawler.crawl_assets (list_all_assets.py)
+- inventory: asset_inventory refresh + read, cold and then unchanged
+- size: asset_size.write_report (asset_size.py)
+- acl: update_acl.update_acls (update_acl.py)
+- rename: rename_collection.copy_images + verify_copies (rename_collection.py)
+
+The throughput in assets/second, the number of fake API calls and the
+peak Python memory traced by tracemalloc are reported for each run.
+No Earth Engine account is needed, but earthengine-api must be
+installed as the scripts import it.
+
+Usage:
+
+python benchmark_asset_tools.py --sizes 1000 10000 100000 --latency 0.005
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import bulk_requests
+from asset_crawler import crawl_assets
+from asset_inventory import AssetInventory
+from asset_size import write_report
+from fake_ee_data import FakeEEData
+from rename_collection import copy_images, verify_copies
+from update_acl import update_acls
+
+TOOLS = ['list', 'inventory', 'size', 'acl', 'rename']
+
+
+def run_list(fake, workdir, args):
+    return sum(1 for _ in crawl_assets(fake.root, max_workers=args.max_workers,
+                                       data=fake))
+
+
+def run_inventory(fake, workdir, args):
+    path = os.path.join(workdir, 'inventory.sqlite')
+    with AssetInventory(path, data=fake) as inventory:
+        inventory.refresh(fake.root, max_workers=args.max_workers)
+        return sum(1 for _ in inventory.iter_assets(fake.root))
+
+
+def run_size(fake, workdir, args):
+    count, _ = write_report(fake.root, os.path.join(workdir, 'sizes.csv'),
+                            max_workers=args.max_workers, data=fake)
+    return count
+
+
+def run_acl(fake, workdir, args):
+    assets = crawl_assets(fake.root, max_workers=args.max_workers, data=fake)
+    with bulk_requests.Journal(os.path.join(workdir, 'acl_journal.txt')) as journal:
+        stats = update_acls(assets, {'all_users_can_read': True}, journal,
+                            max_workers=args.max_workers, rate=args.rate,
+                            data=fake)
+    return sum(stats.counts.values())
+
+
+def run_rename(fake, workdir, args):
+    old_collection = fake.root + '/image_collection0'
+    new_collection = fake.root + '/renamed'
+    fake.createAsset({'type': fake.ASSET_TYPE_IMAGE_COLL}, new_collection)
+    with bulk_requests.Journal(os.path.join(workdir, 'rename_journal.txt')) as journal:
+        old_names, _ = copy_images(old_collection, new_collection, journal,
+                                   max_workers=args.max_workers, rate=args.rate,
+                                   data=fake)
+    missing = verify_copies(old_names, old_collection, new_collection, data=fake)
+    return len(old_names) - len(missing)
+
+
+def make_fake(tool, size, args):
+    options = dict(page_size=args.page_size, latency=args.latency,
+                   jitter=args.latency, quota_error_rate=args.quota_error_rate,
+                   size_in_listing=not args.no_size_in_listing)
+    if tool == 'rename':
+        # A single flat collection
+        return FakeEEData.build(size, depth=1, fan_out=1, **options)
+    return FakeEEData.build(size, depth=args.depth, fan_out=args.fan_out, **options)
+
+
+def measure(function, *function_args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    # The tools print a line per asset
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        count = function(*function_args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', help='number of assets in each synthetic tree',
+                        type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--tools', help='tools to benchmark', nargs='+',
+                        choices=TOOLS, default=TOOLS)
+    parser.add_argument('--depth', help='number of folder levels', type=int, default=2)
+    parser.add_argument('--fan_out', help='number of children per folder', type=int, default=10)
+    parser.add_argument('--page_size', help='maximum listAssets page size', type=int, default=1000)
+    parser.add_argument('--latency', help='injected latency per call in seconds',
+                        type=float, default=0.002)
+    parser.add_argument('--quota_error_rate', help='fraction of calls failing with a quota error',
+                        type=float, default=0.0)
+    parser.add_argument('--no_size_in_listing', help='leave sizeBytes out of listings',
+                        action='store_true')
+    parser.add_argument('--max_workers', help='number of concurrent requests', type=int, default=8)
+    parser.add_argument('--rate', help='rate limit for ACL and copy requests per second',
+                        type=float, default=100000)
+    args = parser.parse_args()
+
+    if args.quota_error_rate:
+        # Keep the backoff short, the fake errors are not real quota limits
+        bulk_requests.MAX_DELAY = 0.01
+
+    tools = {'list': run_list, 'inventory': run_inventory, 'size': run_size,
+             'acl': run_acl, 'rename': run_rename}
+    header = '{:<18} {:>8} {:>9} {:>12} {:>9} {:>10}'.format(
+        'tool', 'assets', 'seconds', 'assets/s', 'calls', 'peak MB')
+    print(header)
+    print('-' * len(header))
+    for size in args.sizes:
+        for tool in args.tools:
+            fake = make_fake(tool, size, args)
+            workdir = tempfile.mkdtemp()
+            try:
+                runs = [(tool, tools[tool])]
+                if tool == 'inventory':
+                    runs = [('inventory (cold)', run_inventory),
+                            ('inventory (warm)', run_inventory)]
+                for label, function in runs:
+                    calls_before = fake.total_calls()
+                    count, elapsed, peak = measure(function, fake, workdir, args)
+                    print('{:<18} {:>8} {:>9.2f} {:>12.0f} {:>9} {:>10.1f}'.format(
+                        label, count, elapsed, count / elapsed if elapsed else 0,
+                        fake.total_calls() - calls_before, peak / 1e6))
+            finally:
+                shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
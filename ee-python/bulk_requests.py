@@ -0,0 +1,204 @@
+"""Helpers for running many Earth Engine requests concurrently.
+
+- TokenBucket: Limits the rate of requests shared by all workers.
+- call_with_retry: Retries a call with exponential backoff on quota
+  errors.
+- imap_bounded: Runs a function over an iterable on a thread pool with
+  a bounded number of tasks in flight.
+- Journal: Append-only checkpoint file so an interrupted run can
+  resume where it stopped.
+- LatencyStats: Collects per-item latencies and prints a summary.
+"""
+import collections
+import concurrent.futures
+import os
+import random
+import threading
+import time
+
+QUOTA_ERROR_MESSAGES = (
+    'quota', 'too many requests', 'rate limit', '429', 'resource_exhausted')
+
+# Default backoff of call_with_retry in seconds
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket rate limiter.
+
+    Tokens are added at `rate` per second up to `capacity`. Each call
+    to acquire() takes one token, waiting until one is available.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_quota_error(error):
+    message = str(error).lower()
+    return any(text in message for text in QUOTA_ERROR_MESSAGES)
+
+
+def call_with_retry(function, *args, retries=5, base_delay=None,
+                    max_delay=None, limiter=None, on_retry=None):
+    """Call `function(*args)`, retrying quota errors with exponential
+    backoff and jitter. Other errors are raised immediately. The delays
+    default to BASE_DELAY and MAX_DELAY.
+
+    If a `limiter` is given, a token is acquired before every attempt.
+    `on_retry` is called with the error before each retry.
+    """
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            return function(*args)
+        except Exception as error:
+            if attempt == retries or not is_quota_error(error):
+                raise
+            if on_retry:
+                on_retry(error)
+            delay = min(MAX_DELAY if max_delay is None else max_delay,
+                        (BASE_DELAY if base_delay is None else base_delay) * 2 ** attempt)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+
+def imap_bounded(function, items, max_workers=8, max_in_flight=None):
+    """Yield (item, future) pairs for function(item) as they complete.
+
+    Unlike executor.map, at most `max_in_flight` items are taken from
+    `items` at a time, so a generator with millions of items is never
+    fully materialized.
+    """
+    max_in_flight = max_in_flight or max_workers * 2
+    items = iter(items)
+    in_flight = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < max_in_flight:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight[executor.submit(function, item)] = item
+            if not in_flight:
+                break
+            done, _ = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future), future
+
+
+class Journal(object):
+    """Append-only checkpoint journal.
+
+    Each line holds a status and a key separated by a tab. Keys that
+    were recorded in a previous run are available in `done`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    status, _, key = line.rstrip('\n').partition('\t')
+                    if key:
+                        self.done[key] = status
+        self.file = open(path, 'a')
+
+    def record(self, key, status):
+        self.file.write('{}\t{}\n'.format(status, key))
+        self.file.flush()
+        self.done[key] = status
+
+    def remove(self, keys):
+        """Forget `keys`, so they are done again by the next run."""
+        keys = set(keys)
+        for key in keys:
+            self.done.pop(key, None)
+        self.file.close()
+        # Rewrite the journal without the keys
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            for key, status in self.done.items():
+                f.write('{}\t{}\n'.format(status, key))
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, 'a')
+
+    def clear(self):
+        """Forget all keys, e.g. after a run finished without errors."""
+        self.done = {}
+        self.file.close()
+        self.file = open(self.path, 'w')
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class LatencyStats(object):
+    """Collects outcomes and latencies of individual items."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.latencies = []
+        self.counts = collections.Counter()
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def add(self, status, latency=None):
+        self.counts[status] += 1
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def add_retry(self, error=None):
+        # Called from worker threads
+        with self.lock:
+            self.retries += 1
+
+    def percentile(self, q):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self):
+        elapsed = time.monotonic() - self.start
+        total = sum(self.counts.values())
+        lines = ['Processed {} items in {:.1f} s ({:.1f} items/s)'.format(
+            total, elapsed, total / elapsed if elapsed else 0)]
+        for status, count in sorted(self.counts.items()):
+            lines.append('  {}: {}'.format(status, count))
+        if self.retries:
+            lines.append('Retried {} requests after quota errors'.format(self.retries))
+        if self.latencies:
+            lines.append('Latency p50 {:.3f} s, p95 {:.3f} s, max {:.3f} s'.format(
+                self.percentile(50), self.percentile(95), max(self.latencies)))
+        return '\n'.join(lines)
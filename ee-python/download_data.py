@@ -2,68 +2,286 @@
 using Google Earth Engine API.
 
 This script computes the average soil moisture for the
-past 1-week over all districts in a state. The result 
+past 1-week over all districts in a state. The result
 is then downloaded as a JSON file and saved locally.
 
+The districts are split into chunks of --chunk_size features. Each
+chunk is reduced and downloaded with its own getInfo() call, several
+chunks run concurrently, and the features of each chunk are streamed
+to the output file as they arrive. Chunks that fail are retried on
+their own. Every downloaded chunk is cached on disk under a key made
+of the dataset, date window and region, so a rerun on the same day
+only requests the chunks that are not cached yet.
+
 The Python environment needs to have earthengine-api
 package installed. After install, a one-time authentication
 needs to be completed using 'earthengine authenticate'
-command.
+command. Writing GeoParquet output needs pyarrow and shapely.
+
+Usage:
+
+python download_data.py --filter_value Karnataka
+
+Download all districts of India as GeoParquet
+python download_data.py --filter_property ADM0_NAME --filter_value India --format parquet
 """
-import ee
+import argparse
+import datetime
+import hashlib
 import json
 import os
+import ee
+import ee_instrument
+from bulk_requests import call_with_retry, imap_bounded
 
-# Replace the cloud_project with your own project
-cloud_project = 'spatialthoughts'
+# Datasets
+soilmoisture_id = 'NASA_USDA/HSL/SMAP10KM_soil_moisture'
+admin2_id = 'FAO/GAUL_SIMPLIFIED_500m/2015/level2'
 
-try:
-    ee.Initialize(project=cloud_project)
-except:
-    ee.Authenticate()
-    ee.Initialize(project=cloud_project)
+# Select columns to keep and their types for the Parquet output
+# Change column names to match your uploaded shapefile
+columns = ['ADM2_NAME', 'meanssm']
+column_types = {'ADM2_NAME': 'string', 'meanssm': 'float64'}
 
-# Get current date and convert to milliseconds 
-end_date = ee.Date(datetime.datetime.now().timestamp()*1000)
-start_date = end_date.advance(-1, 'week')
 
-date_string = end_date.format('YYYY_MM_dd')
-filename = 'ssm_{}.geojson'.format(date_string.getInfo())
+def cache_key(**params):
+    """Return a short hash identifying a download request."""
+    text = json.dumps(params, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
 
-# Saving to current directory. You can change the path to appropriate location
-output_path = os.path.join(filename)
 
-# Datasets
-soilmoisture = ee.ImageCollection("NASA_USDA/HSL/SMAP10KM_soil_moisture")
-admin2 = ee.FeatureCollection("FAO/GAUL_SIMPLIFIED_500m/2015/level2")
+class ChunkCache(object):
+    """Stores the features of each downloaded chunk as a JSON file."""
 
-# Filter to a state
-karnataka = admin2.filter(ee.Filter.eq('ADM1_NAME', 'Karnataka'))
+    def __init__(self, cache_dir, key):
+        self.folder = os.path.join(cache_dir, key)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
 
-# Select the ssm band
-ssm  = soilmoisture.select('ssm')
+    def path(self, name):
+        return os.path.join(self.folder, '{}.json'.format(name))
 
-filtered = ssm .filter(ee.Filter.date(start_date, end_date))
+    def get(self, name):
+        if os.path.exists(self.path(name)):
+            with open(self.path(name)) as f:
+                return json.load(f)
+        return None
 
-mean = filtered.mean()
+    def put(self, name, value):
+        # Write to a temporary file first so an interrupted run never
+        # leaves a partial chunk in the cache
+        temp_path = self.path(name) + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(temp_path, self.path(name))
 
-stats = mean.reduceRegions(**{
-  'collection': karnataka,
-  'reducer': ee.Reducer.mean().setOutputs(['meanssm']),
-  'scale': 10000,
-  })
 
-# Select columns to keep and remove geometry to make the result lightweight
-# Change column names to match your uploaded shapefile
-columns = ['ADM2_NAME', 'meanssm']
-exportCollection = stats.select(**{
-    'propertySelectors': columns,
-    'retainGeometry': False})
+class GeoJSONWriter(object):
+    """Streams features into a GeoJSON FeatureCollection file."""
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.file.write('{"type": "FeatureCollection", "features": [\n')
+        self.first = True
+
+    def write(self, features):
+        for feature in features:
+            if not self.first:
+                self.file.write(',\n')
+            self.file.write(json.dumps(feature))
+            self.first = False
+
+    def close(self):
+        self.file.write('\n]}\n')
+        self.file.close()
+
+
+class GeoParquetWriter(object):
+    """Streams features into a (Geo)Parquet file, one row group per chunk."""
+
+    def __init__(self, path, retain_geometry):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.retain_geometry = retain_geometry
+        if retain_geometry:
+            from shapely.geometry import shape
+            self.shape = shape
+        fields = [pa.field(name, column_types.get(name, 'string'))
+                  for name in columns]
+        metadata = None
+        if retain_geometry:
+            fields.append(pa.field('geometry', pa.binary()))
+            metadata = {'geo': json.dumps({
+                'version': '1.0.0',
+                'primary_column': 'geometry',
+                # Without a crs the default OGC:CRS84 applies, which
+                # matches the EPSG:4326 geometries from getInfo()
+                'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': []}}})}
+        self.schema = pa.schema(fields, metadata=metadata)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, features):
+        rows = []
+        for feature in features:
+            row = {name: feature['properties'].get(name) for name in columns}
+            if self.retain_geometry:
+                geometry = feature.get('geometry')
+                row['geometry'] = self.shape(geometry).wkb if geometry else None
+            rows.append(row)
+        if rows:
+            self.writer.write_table(
+                self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def get_stats_chunk(region, image, offset, chunk_size, retain_geometry):
+    """Compute the zonal statistics of one chunk of the region."""
+    chunk = ee.FeatureCollection(region.toList(chunk_size, offset))
+    stats = image.reduceRegions(**{
+      'collection': chunk,
+      'reducer': ee.Reducer.mean().setOutputs(['meanssm']),
+      'scale': 10000,
+      })
+    # Select columns to keep and remove geometry to make the result lightweight
+    exportCollection = stats.select(**{
+        'propertySelectors': columns,
+        'retainGeometry': retain_geometry})
+    return exportCollection.getInfo()['features']
+
+
+def download(region, image, writer, cache, chunk_size=50, max_workers=4,
+             retries=5, max_passes=3, retain_geometry=False,
+             sort_key='system:index'):
+    """Download the zonal statistics of `region` chunk by chunk.
+
+    The region is sorted on `sort_key` first, so every request (and
+    retry) pages through the features in the same order.
+    Returns the list of chunk offsets that still failed after
+    `max_passes` attempts.
+    """
+    region = region.sort(sort_key)
+    count = cache.get('count')
+    if count is None:
+        count = region.size().getInfo()
+        cache.put('count', count)
+    offsets = list(range(0, count, chunk_size))
+    print('Downloading {} features in {} chunks'.format(count, len(offsets)))
+
+    todo = []
+    for offset in offsets:
+        features = cache.get('chunk_{}'.format(offset))
+        if features is None:
+            todo.append(offset)
+        else:
+            writer.write(features)
+    if len(todo) < len(offsets):
+        print('Read {} chunks from cache'.format(len(offsets) - len(todo)))
+
+    def fetch(offset):
+        return call_with_retry(get_stats_chunk, region, image, offset,
+                               chunk_size, retain_geometry, retries=retries)
+
+    for attempt in range(max_passes):
+        if not todo:
+            break
+        failed = []
+        for offset, future in imap_bounded(fetch, todo, max_workers):
+            try:
+                features = future.result()
+            except Exception as error:
+                print('Chunk at offset {} failed: {}'.format(offset, error))
+                failed.append(offset)
+                continue
+            cache.put('chunk_{}'.format(offset), features)
+            writer.write(features)
+            print('Downloaded chunk at offset {}'.format(offset))
+        todo = failed
+    return todo
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filter_property', help='property of the admin2 collection to filter on',
+                        default='ADM1_NAME')
+    parser.add_argument('--filter_value', help='value of the filter property',
+                        default='Karnataka')
+    parser.add_argument('--chunk_size', help='number of features per request',
+                        type=int, default=50)
+    parser.add_argument('--max_workers', help='number of concurrent requests',
+                        type=int, default=4)
+    parser.add_argument('--format', help='output format',
+                        choices=['geojson', 'parquet'], default='geojson')
+    parser.add_argument('--retain_geometry', help='keep feature geometries in the output',
+                        action='store_true')
+    parser.add_argument('--cache_dir', help='folder for cached chunks',
+                        default='ee_cache')
+    ee_instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    # Replace the cloud_project with your own project
+    cloud_project = 'spatialthoughts'
+
+    try:
+        ee.Initialize(project=cloud_project)
+    except:
+        ee.Authenticate()
+        ee.Initialize(project=cloud_project)
+
+    ee_instrument.enable_from_args(args)
+
+    # Get current date. The date window is computed locally so it can
+    # be part of the cache key without a request to the server. The end
+    # of a date filter is exclusive, so it is set to tomorrow to include
+    # the images of today.
+    today = datetime.date.today()
+    end_date = today + datetime.timedelta(days=1)
+    start_date = end_date - datetime.timedelta(weeks=1)
+
+    date_string = today.strftime('%Y_%m_%d')
+    extension = 'geojson' if args.format == 'geojson' else 'parquet'
+    filename = 'ssm_{}.{}'.format(date_string, extension)
+
+    # Saving to current directory. You can change the path to appropriate location
+    output_path = os.path.join(filename)
+
+    soilmoisture = ee.ImageCollection(soilmoisture_id)
+    admin2 = ee.FeatureCollection(admin2_id)
+
+    # Filter to a region
+    region = admin2.filter(ee.Filter.eq(args.filter_property, args.filter_value))
+
+    # Select the ssm band
+    ssm  = soilmoisture.select('ssm')
+
+    filtered = ssm.filter(ee.Filter.date(start_date.isoformat(), end_date.isoformat()))
+
+    mean = filtered.mean()
+
+    key = cache_key(
+        dataset=soilmoisture_id, start=start_date.isoformat(),
+        end=end_date.isoformat(), regions=admin2_id,
+        filter=[args.filter_property, args.filter_value], columns=columns,
+        chunk_size=args.chunk_size, retain_geometry=args.retain_geometry,
+        sort='system:index')
+    cache = ChunkCache(args.cache_dir, key)
+
+    if args.format == 'geojson':
+        writer = GeoJSONWriter(output_path)
+    else:
+        writer = GeoParquetWriter(output_path, args.retain_geometry)
 
-# Get the result from the server
-output = json.dumps(exportCollection.getInfo())
+    try:
+        failed = download(region, mean, writer, cache,
+                          chunk_size=args.chunk_size, max_workers=args.max_workers,
+                          retain_geometry=args.retain_geometry)
+    finally:
+        writer.close()
 
-with open(output_path, 'w') as f:
-    f.write(output)
-    print('Success: File written at', output_path)
-    
+    if failed:
+        print('Failed: {} chunks could not be downloaded. '
+              'Run the script again to retry them.'.format(len(failed)))
+    else:
+        print('Success: File written at', output_path)
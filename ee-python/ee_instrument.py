@@ -0,0 +1,225 @@
+"""Instrumentation for Earth Engine API calls.
+
+enable() wraps the ee.data functions used by the scripts in this
+folder and ee.ComputedObject.getInfo. For every method it records the
+number of calls, a latency histogram, the size of the responses,
+retries and errors. A summary table is printed when the script exits,
+comparing the wall-clock time spent waiting on Earth Engine with the
+total run time. Optionally every call is also written to a JSON trace
+file.
+
+A call is counted as a retry when it repeats, on the same thread, the
+method and arguments of a call that just failed, which is how
+bulk_requests.call_with_retry retries.
+
+Usage:
+
+import ee_instrument
+ee_instrument.enable(trace_path='trace.json')
+"""
+import atexit
+import collections
+import functools
+import json
+import threading
+import time
+import ee
+
+DATA_METHODS = [
+    'listAssets', 'getAsset', 'getAssetAcl', 'setAssetAcl', 'copyAsset',
+    'deleteAsset', 'createAsset', 'updateAsset', 'computeValue',
+    'getMapId', 'getList', 'startProcessing', 'getTaskStatus',
+]
+
+# Upper bounds of the latency histogram buckets in seconds
+BUCKETS = [0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, float('inf')]
+
+
+def bucket_label(bound):
+    if bound == float('inf'):
+        return '>{:g}s'.format(BUCKETS[-2])
+    return '<{:g}s'.format(bound)
+
+
+class MethodStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+        self.histogram = [0] * len(BUCKETS)
+
+    def add(self, seconds, size, error):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes += size
+        if error:
+            self.errors += 1
+        for index, bound in enumerate(BUCKETS):
+            if seconds < bound:
+                self.histogram[index] += 1
+                break
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'seconds': round(self.seconds, 3),
+            'max_seconds': round(self.max_seconds, 3),
+            'bytes': self.bytes,
+            'histogram': dict(zip([bucket_label(b) for b in BUCKETS],
+                                  self.histogram)),
+        }
+
+
+class Recorder(object):
+    """Collects the statistics of all wrapped calls. Thread-safe."""
+
+    def __init__(self, trace_path=None):
+        self.start = time.monotonic()
+        self.stats = collections.defaultdict(MethodStats)
+        self.trace_path = trace_path
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # Wall-clock time during which at least one call was running
+        self.active = 0
+        self.active_since = 0.0
+        self.busy_seconds = 0.0
+
+    def begin(self, name, args):
+        # Identify the call without serializing ee objects
+        key = (name, tuple(arg if isinstance(arg, (str, int, float)) else id(arg)
+                           for arg in args))
+        with self.lock:
+            if getattr(self.local, 'failed_key', None) == key:
+                self.stats[name].retries += 1
+            self.local.failed_key = None
+            if not self.active:
+                self.active_since = time.monotonic()
+            self.active += 1
+        return key, time.monotonic()
+
+    def end(self, name, key, started, size, error):
+        now = time.monotonic()
+        with self.lock:
+            self.active -= 1
+            if not self.active:
+                self.busy_seconds += now - self.active_since
+            self.stats[name].add(now - started, size, error)
+            if error:
+                self.local.failed_key = key
+            if self.trace_path:
+                self.events.append({
+                    'method': name,
+                    'start': round(started - self.start, 6),
+                    'seconds': round(now - started, 6),
+                    'bytes': size,
+                    'error': str(error) if error else None,
+                })
+
+    def wrap(self, name, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key, started = self.begin(name, args)
+            try:
+                result = function(*args, **kwargs)
+            except Exception as error:
+                self.end(name, key, started, 0, error)
+                raise
+            self.end(name, key, started, response_size(result), None)
+            return result
+        wrapper.instrumented = True
+        return wrapper
+
+    def summary(self):
+        elapsed = time.monotonic() - self.start
+        header = '{:<16} {:>7} {:>6} {:>7} {:>9} {:>8} {:>8} {:>10}'.format(
+            'method', 'calls', 'errors', 'retries', 'total s', 'mean s',
+            'max s', 'MB')
+        lines = ['Earth Engine API calls', header, '-' * len(header)]
+        for name, stats in sorted(self.stats.items(),
+                                  key=lambda item: -item[1].seconds):
+            lines.append('{:<16} {:>7} {:>6} {:>7} {:>9.2f} {:>8.3f} {:>8.3f} {:>10.2f}'.format(
+                name, stats.calls, stats.errors, stats.retries, stats.seconds,
+                stats.seconds / stats.calls if stats.calls else 0,
+                stats.max_seconds, stats.bytes / 1e6))
+        lines.append('Latency histogram (calls per bucket)')
+        labels = [bucket_label(b) for b in BUCKETS]
+        lines.append('{:<16} '.format('method') + ' '.join(
+            '{:>7}'.format(label) for label in labels))
+        for name, stats in sorted(self.stats.items()):
+            lines.append('{:<16} '.format(name) + ' '.join(
+                '{:>7}'.format(count) for count in stats.histogram))
+        lines.append('Waiting on Earth Engine {:.1f} s of {:.1f} s wall-clock time'.format(
+            self.busy_seconds, elapsed))
+        return '\n'.join(lines)
+
+    def write_trace(self):
+        with open(self.trace_path, 'w') as f:
+            json.dump({
+                'elapsed_seconds': round(time.monotonic() - self.start, 3),
+                'busy_seconds': round(self.busy_seconds, 3),
+                'methods': {name: stats.to_dict()
+                            for name, stats in self.stats.items()},
+                'events': self.events,
+            }, f, indent=1)
+
+    def report(self):
+        print(self.summary())
+        if self.trace_path:
+            self.write_trace()
+            print('Trace written at {}'.format(self.trace_path))
+
+
+def response_size(result):
+    """Approximate size of a response in bytes, as serialized JSON."""
+    if result is None:
+        return 0
+    try:
+        return len(json.dumps(result, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+recorder = None
+
+
+def enable(trace_path=None, report_at_exit=True, data=None):
+    """Start recording Earth Engine API calls.
+
+    `data` is the module implementing the ee.data API whose functions
+    are wrapped, ee.data by default.
+    """
+    global recorder
+    if recorder is not None:
+        return recorder
+    recorder = Recorder(trace_path)
+    data = data or ee.data
+    for name in DATA_METHODS:
+        function = getattr(data, name, None)
+        if function is not None and not getattr(function, 'instrumented', False):
+            setattr(data, name, recorder.wrap(name, function))
+    computed_object = getattr(ee, 'ComputedObject', None)
+    if computed_object is not None and hasattr(computed_object, 'getInfo'):
+        computed_object.getInfo = recorder.wrap('getInfo', computed_object.getInfo)
+    if report_at_exit:
+        atexit.register(recorder.report)
+    return recorder
+
+
+def add_arguments(parser):
+    """Add the --instrument and --trace_file options to a parser."""
+    parser.add_argument('--instrument', help='print a summary of Earth Engine API calls at exit',
+                        action='store_true')
+    parser.add_argument('--trace_file', help='also write every Earth Engine API call to this JSON file')
+
+
+def enable_from_args(args):
+    if args.instrument or args.trace_file:
+        enable(trace_path=args.trace_file)
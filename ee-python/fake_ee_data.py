@@ -0,0 +1,213 @@
+"""An in-process stand-in for the parts of ee.data used by the asset
+scripts in this folder.
+
+FakeEEData holds a synthetic asset tree in memory and implements
+getAsset, listAssets (with pageSize/pageToken), getAssetAcl,
+setAssetAcl, copyAsset, deleteAsset, createAsset and updateAsset.
+Every call can sleep for an injected latency and fail with a quota
+error at a given rate, and listings can leave out sizeBytes like some
+real listings do, so the scripts can be measured and tested without
+touching a live project. Pass an instance as the `data` argument of
+the script functions, e.g. crawl_assets(root, data=fake).
+
+Changing an asset gives it a new updateTime. Adding or deleting an
+asset also gives its folder a new updateTime. With
+propagate_update_time=True (the default) the change is propagated to
+all parent folders too. This is what the incremental refresh of
+asset_inventory.py relies on; set it to False to test the scripts
+when only the folder that changed gets a new updateTime.
+
+Usage:
+
+from fake_ee_data import FakeEEData
+
+fake = FakeEEData.build(10000, depth=2, fan_out=10, page_size=1000)
+root = fake.root
+"""
+import random
+import threading
+import time
+
+ROOT = 'projects/fake-project/assets'
+
+
+class QuotaError(Exception):
+    """Raised for injected errors. The message matches the quota errors
+    returned by Earth Engine, so they are retried by call_with_retry."""
+
+    def __init__(self, method):
+        super(QuotaError, self).__init__(
+            'Quota exceeded for {}: Too Many Requests'.format(method))
+
+
+class FakeEEData(object):
+
+    ASSET_TYPE_FOLDER = 'Folder'
+    ASSET_TYPE_IMAGE_COLL = 'ImageCollection'
+
+    def __init__(self, page_size=1000, latency=0.0, jitter=0.0,
+                 quota_error_rate=0.0, size_in_listing=True, seed=0,
+                 propagate_update_time=True):
+        self.max_page_size = page_size
+        self.propagate_update_time = propagate_update_time
+        self.size_in_listing = size_in_listing
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_error_rate = quota_error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.assets = {}
+        self.children = {}
+        self.acls = {}
+        self.calls = {}
+        self.clock = 0
+        self.root = ROOT
+        self._add(ROOT, 'FOLDER')
+
+    @classmethod
+    def build(cls, n_assets, depth=2, fan_out=10, container='IMAGE_COLLECTION',
+              size_bytes=1000000, **kwargs):
+        """Create a tree with `depth` levels of `fan_out` folders above
+        leaf containers of type `container` holding about `n_assets`
+        images in total."""
+        fake = cls(**kwargs)
+        level = [ROOT]
+        for d in range(depth):
+            next_level = []
+            for parent in level:
+                for i in range(fan_out):
+                    kind = container if d == depth - 1 else 'FOLDER'
+                    name = '{}/{}{}'.format(parent, kind.lower(), i)
+                    fake._add(name, kind)
+                    next_level.append(name)
+            level = next_level
+        leaves = level
+        for i in range(n_assets):
+            parent = leaves[i % len(leaves)]
+            fake._add('{}/image{}'.format(parent, i), 'IMAGE',
+                      size_bytes=size_bytes + fake.random.randint(0, size_bytes))
+        return fake
+
+    def _add(self, name, asset_type, size_bytes=None):
+        self.clock += 1
+        asset = {
+            'type': asset_type,
+            'name': name,
+            'id': name.replace(ROOT + '/', 'users/fake/', 1),
+            'updateTime': '2024-01-01T00:00:{:09d}Z'.format(self.clock),
+        }
+        if size_bytes is not None:
+            asset['sizeBytes'] = str(size_bytes)
+        self.assets[name] = asset
+        if asset_type in ('FOLDER', 'IMAGE_COLLECTION'):
+            self.children.setdefault(name, [])
+        if name != ROOT:
+            parent = name.rsplit('/', 1)[0]
+            self.children[parent].append(name)
+            self._touch(parent)
+
+    def _touch(self, name):
+        """Set a new updateTime on `name`, and on all of its parents if
+        propagate_update_time is set."""
+        self.clock += 1
+        update_time = '2024-01-01T00:00:{:09d}Z'.format(self.clock)
+        while True:
+            self.assets[name]['updateTime'] = update_time
+            if name == ROOT or not self.propagate_update_time:
+                break
+            name = name.rsplit('/', 1)[0]
+
+    def _call(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            fail = self.random.random() < self.quota_error_rate
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise QuotaError(method)
+
+    def _resolve(self, name):
+        if name in self.assets:
+            return name
+        if name.startswith('users/fake/'):
+            return name.replace('users/fake/', ROOT + '/', 1)
+        raise Exception('Asset "{}" not found.'.format(name))
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def getAsset(self, name):
+        self._call('getAsset')
+        with self.lock:
+            return dict(self.assets[self._resolve(name)])
+
+    def listAssets(self, params):
+        self._call('listAssets')
+        with self.lock:
+            parent = self._resolve(params['parent'])
+            page_size = min(int(params.get('pageSize') or self.max_page_size),
+                            self.max_page_size)
+            start = int(params.get('pageToken') or 0)
+            names = self.children[parent][start:start + page_size]
+            assets = [dict(self.assets[n]) for n in names]
+            if not self.size_in_listing:
+                for asset in assets:
+                    asset.pop('sizeBytes', None)
+            response = {'assets': assets}
+            if start + page_size < len(self.children[parent]):
+                response['nextPageToken'] = str(start + page_size)
+            return response
+
+    def getAssetAcl(self, name):
+        self._call('getAssetAcl')
+        with self.lock:
+            acl = {'owners': ['user:fake@example.com'], 'readers': [], 'writers': []}
+            acl.update(self.acls.get(self._resolve(name), {}))
+            return acl
+
+    def setAssetAcl(self, name, acl_update):
+        self._call('setAssetAcl')
+        with self.lock:
+            self.acls[self._resolve(name)] = dict(acl_update)
+
+    def copyAsset(self, source, destination, allowOverwrite=False):
+        self._call('copyAsset')
+        with self.lock:
+            source = self.assets[self._resolve(source)]
+            if destination in self.assets:
+                if not allowOverwrite:
+                    raise Exception('Cannot overwrite asset "{}".'.format(destination))
+                return
+            self._add(destination, source['type'],
+                      size_bytes=source.get('sizeBytes'))
+
+    def deleteAsset(self, name):
+        self._call('deleteAsset')
+        with self.lock:
+            name = self._resolve(name)
+            if self.children.get(name):
+                raise Exception('Cannot delete non-empty container "{}".'.format(name))
+            del self.assets[name]
+            self.children.pop(name, None)
+            parent = name.rsplit('/', 1)[0]
+            self.children[parent].remove(name)
+            self._touch(parent)
+
+    def createAsset(self, value, path=None):
+        self._call('createAsset')
+        asset_type = {'Folder': 'FOLDER',
+                      'ImageCollection': 'IMAGE_COLLECTION'}.get(
+                          value['type'], value['type'])
+        with self.lock:
+            if not path.startswith('projects/'):
+                path = path.replace('users/fake/', ROOT + '/', 1)
+            self._add(path, asset_type)
+
+    def updateAsset(self, asset_id, asset, update_mask):
+        self._call('updateAsset')
+        with self.lock:
+            name = self._resolve(asset_id)
+            for key in update_mask:
+                self.assets[name][key] = asset[key]
+            self._touch(name)
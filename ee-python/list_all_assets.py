@@ -1,8 +1,21 @@
+"""This script recursively lists all assets in a folder.
+
+Usage:
+
+python list_all_assets.py --asset_folder <path to any asset folder>
+"""
 import argparse
 import ee
+import ee_instrument
+from asset_inventory import iter_tree
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--asset_folder', help='full path to the asset folder')
+parser.add_argument('--max_workers', help='number of concurrent listing requests',
+                    type=int, default=8)
+parser.add_argument('--inventory', help='path to a local SQLite asset inventory to '
+                    'refresh and read instead of crawling the whole folder')
+ee_instrument.add_arguments(parser)
 args = parser.parse_args()
 parent = args.asset_folder
 
@@ -15,26 +28,12 @@ except:
     ee.Authenticate()
     ee.Initialize(project=cloud_project)
 
+ee_instrument.enable_from_args(args)
+
+count = 0
+for asset in iter_tree(parent, inventory_path=args.inventory,
+                       max_workers=args.max_workers):
+    print(asset['name'])
+    count += 1
 
-def get_asset_list(parent):
-    parent_asset = ee.data.getAsset(parent)
-    parent_id = parent_asset['name']
-    parent_type = parent_asset['type']
-    asset_list = []
-    child_assets = ee.data.listAssets({'parent': parent_id})['assets']
-    for child_asset in child_assets:
-        child_id = child_asset['name']
-        child_type = child_asset['type']
-        if child_type in ['FOLDER','IMAGE_COLLECTION']:
-            # Recursively call the function to get child assets
-            asset_list.extend(get_asset_list(child_id))
-        else:
-            asset_list.append(child_id)
-    return asset_list
-    
-all_assets = get_asset_list(parent)
-
-print('Found {} assets'.format(len(all_assets)))
-
-for asset in all_assets:
-	print(asset)
\ No newline at end of file
+print('Found {} assets'.format(count))
@@ -4,6 +4,14 @@ GEE collections cannot be renamed directly, so this script
 provides a simple way to get all assets in a collection
 and copies it to the new collection
 
+Images are copied on a pool of workers and every page of the
+collection listing is followed. Each finished copy is recorded in a
+journal file as a (source, destination) pair, so an interrupted run
+can be started again and it only copies the remaining images. Copies
+that turn out to be missing are removed from the journal, so the next
+run copies them again. Source images are deleted only after all
+copies have been verified to exist in the new collection.
+
 Sample usage:
 python rename_collection.py --old_collection <old_collection> --new_collection <new_collection>
 
@@ -12,47 +20,148 @@ python rename_collection.py --old_collection <old_collection> --new_collection <
 """
 import argparse
 import ee
+import ee_instrument
+from asset_crawler import list_children
+from bulk_requests import (Journal, LatencyStats, TokenBucket,
+                           call_with_retry, imap_bounded)
+
+
+def new_name_for(old_name, old_collection, new_collection):
+    return new_collection + old_name[len(old_collection):]
+
+
+def journal_key(old_name, new_name):
+    return '{}\t{}'.format(old_name, new_name)
+
+
+def copy_images(old_collection, new_collection, journal, max_workers=8,
+                rate=10, retries=5, data=None):
+    """Copy all images of `old_collection` to `new_collection`.
+
+    Images already recorded in the journal for the same destination
+    are not copied again.
+    Returns a tuple of (list of old image names, LatencyStats).
+    """
+    data = data or ee.data
+    limiter = TokenBucket(rate)
+    stats = LatencyStats()
+    old_names = []
+
+    def copy(old_name):
+        new_name = new_name_for(old_name, old_collection, new_collection)
+        call_with_retry(data.copyAsset, old_name, new_name, True,
+                        retries=retries, limiter=limiter,
+                        on_retry=stats.add_retry)
+
+    def todo():
+        for asset in list_children(old_collection, data=data):
+            old_name = asset['name']
+            old_names.append(old_name)
+            new_name = new_name_for(old_name, old_collection, new_collection)
+            if journal_key(old_name, new_name) in journal.done:
+                stats.add('resumed')
+            else:
+                yield old_name
+
+    for old_name, future in imap_bounded(copy, todo(), max_workers):
+        try:
+            future.result()
+        except Exception as error:
+            print('Failed to copy {}: {}'.format(old_name, error))
+            stats.add('failed')
+            continue
+        print('Copied {}'.format(old_name))
+        journal.record(journal_key(
+            old_name, new_name_for(old_name, old_collection, new_collection)), 'copied')
+        stats.add('copied')
+    return old_names, stats
+
+
+def verify_copies(old_names, old_collection, new_collection, data=None):
+    """Return the old image names whose copy is missing in `new_collection`."""
+    copied = set(asset['name'] for asset in list_children(new_collection, data=data))
+    return [name for name in old_names
+            if new_name_for(name, old_collection, new_collection) not in copied]
+
+
+def delete_sources(old_names, old_collection, max_workers=8, rate=10,
+                   retries=5, data=None):
+    data = data or ee.data
+    limiter = TokenBucket(rate)
+
+    def delete(old_name):
+        call_with_retry(data.deleteAsset, old_name, retries=retries,
+                        limiter=limiter)
+
+    failed = 0
+    for old_name, future in imap_bounded(delete, old_names, max_workers):
+        try:
+            future.result()
+            print('Deleted <{}>'.format(old_name))
+        except Exception as error:
+            print('Failed to delete {}: {}'.format(old_name, error))
+            failed += 1
+    if not failed:
+        print('Deleting Collection <{}>'.format(old_collection))
+        data.deleteAsset(old_collection)
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage='python rename_collection.py --old_collection <old collection> --new_collection <new collection>')
+    parser.add_argument('--old_collection', help='old collection')
+    parser.add_argument('--new_collection', help='new collection')
+    parser.add_argument('--delete', help='delete old collection', action=argparse.BooleanOptionalAction)
+    parser.add_argument('--max_workers', help='number of concurrent copy requests',
+                        type=int, default=8)
+    parser.add_argument('--rate', help='maximum number of requests per second',
+                        type=float, default=10)
+    parser.add_argument('--retries', help='number of retries on quota errors',
+                        type=int, default=5)
+    parser.add_argument('--journal', help='checkpoint file used to resume an interrupted run',
+                        default='rename_journal.txt')
+    ee_instrument.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    # Replace the cloud_project with your own project
+    cloud_project = 'spatialthoughts'
+
+    try:
+        ee.Initialize(project=cloud_project)
+    except:
+        ee.Authenticate()
+        ee.Initialize(project=cloud_project)
+
+    ee_instrument.enable_from_args(args)
+
+    # Use full asset names so that old and new image names line up
+    # with the names returned by ee.data.listAssets
+    old_collection = ee.data.getAsset(args.old_collection)['name']
+    new_collection = args.new_collection
+
+    # Check if new collection exists
+    try:
+        new_collection = ee.data.getAsset(new_collection)['name']
+    except:
+        print('Collection {} does not exist'.format(new_collection))
+        ee.data.createAsset({'type': ee.data.ASSET_TYPE_IMAGE_COLL}, new_collection)
+        print('Created a new empty collection {}.'.format(new_collection))
+        new_collection = ee.data.getAsset(new_collection)['name']
+
+    with Journal(args.journal) as journal:
+        old_names, stats = copy_images(
+            old_collection, new_collection, journal,
+            max_workers=args.max_workers, rate=args.rate, retries=args.retries)
+        print(stats.summary())
 
-parser = argparse.ArgumentParser(usage='python rename_collection.py --old_collection <old collection> --new_collection <new collection>')
-parser.add_argument('--old_collection', help='old collection')
-parser.add_argument('--new_collection', help='new collection')
-parser.add_argument('--delete', help='delete old collection', action=argparse.BooleanOptionalAction)
-
-args = parser.parse_args()
-
-old_collection = args.old_collection
-new_collection = args.new_collection
-
-# Replace the cloud_project with your own project
-cloud_project = 'spatialthoughts'
-
-try:
-    ee.Initialize(project=cloud_project)
-except:
-    ee.Authenticate()
-    ee.Initialize(project=cloud_project)
-
-# Check if new collection exists
-try:
-    ee.ImageCollection(new_collection).getInfo()
-except:
-    print('Collection {} does not exist'.format(new_collection))
-    ee.data.createAsset({'type': ee.data.ASSET_TYPE_IMAGE_COLL}, new_collection)
-    print('Created a new empty collection {}.'.format(new_collection))
-    
-
-assets = ee.data.listAssets({'parent': old_collection})['assets']
-
-
-for asset in assets:
-    old_name = asset['name']
-    new_name = old_name.replace(old_collection, new_collection)
-    print('Copying {} to {}'.format(old_name, new_name))
-    ee.data.copyAsset(old_name, new_name, True)
-    if args.delete:
-        print('Deleting <{}>'.format(old_name))
-        ee.data.deleteAsset(old_name)
-
-if args.delete:
-    print('Deleting Collection <{}>'.format(old_collection))
-    ee.data.deleteAsset(old_collection)
\ No newline at end of file
+        missing = verify_copies(old_names, old_collection, new_collection)
+        # Copy the missing images again on the next run
+        journal.remove(journal_key(name, new_name_for(name, old_collection, new_collection))
+                       for name in missing)
+    if missing:
+        print('{} images are missing in {}. Run the script again to copy them.'.format(
+            len(missing), new_collection))
+    elif args.delete:
+        delete_sources(old_names, old_collection, max_workers=args.max_workers,
+                       rate=args.rate, retries=args.retries)
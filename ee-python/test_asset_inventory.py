@@ -0,0 +1,125 @@
+"""Tests for the incremental refresh of asset_inventory.py against
+fake_ee_data.FakeEEData.
+
+No Earth Engine account is needed, but earthengine-api must be
+installed as the scripts import it.
+
+Run with: python -m pytest test_asset_inventory.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from asset_crawler import crawl_assets
+from asset_inventory import AssetInventory, iter_tree
+from fake_ee_data import FakeEEData
+
+
+def snapshot(assets):
+    return dict((asset['name'], asset.get('sizeBytes')) for asset in assets)
+
+
+class AssetInventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'inventory.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def build(self, **kwargs):
+        # 3 levels of 3 folders above 27 collections of 4 images
+        return FakeEEData.build(108, depth=3, fan_out=3, **kwargs)
+
+    def expected(self, fake):
+        # Sizes come from the records of the fake, as listings may not
+        # include them
+        return snapshot(fake.assets[asset['name']]
+                        for asset in crawl_assets(fake.root, data=fake))
+
+    def check(self, fake, inventory):
+        self.assertEqual(snapshot(inventory.iter_assets(fake.root)), self.expected(fake))
+
+    def change_deep_assets(self, fake):
+        """Add, delete and modify images in collections at the bottom
+        of the tree."""
+        collection = fake.root + '/folder1/folder2/image_collection0'
+        fake.createAsset({'type': 'IMAGE'}, collection + '/new_image')
+        fake.deleteAsset(fake.children[fake.root + '/folder0/folder1/image_collection2'][0])
+        image = fake.children[fake.root + '/folder2/folder0/image_collection1'][-1]
+        fake.updateAsset(image, {'sizeBytes': '123'}, ['sizeBytes'])
+
+    def test_incremental_refresh(self):
+        for size_in_listing in [True, False]:
+            fake = self.build(size_in_listing=size_in_listing)
+            path = os.path.join(self.workdir, 'inventory_{}.sqlite'.format(size_in_listing))
+            with AssetInventory(path, data=fake) as inventory:
+                cold = inventory.refresh(fake.root)
+                self.check(fake, inventory)
+                self.change_deep_assets(fake)
+                warm = inventory.refresh(fake.root)
+                self.check(fake, inventory)
+                # Only the changed branches are listed again
+                self.assertLess(warm, cold / 2)
+
+    def test_unchanged_refresh_counts_pages(self):
+        fake = self.build(page_size=2)
+        with AssetInventory(self.path, data=fake) as inventory:
+            inventory.refresh(fake.root)
+            calls = fake.total_calls()
+            # getAsset of the root and 2 pages listing its 3 folders
+            self.assertEqual(inventory.refresh(fake.root), 3)
+            self.assertEqual(fake.total_calls() - calls, 3)
+
+    def test_interrupted_refresh_descends_again(self):
+        fake = self.build()
+        failing = fake.root + '/folder1/folder2/image_collection2'
+        list_assets = fake.listAssets
+        failures = []
+
+        def flaky_list_assets(params):
+            if params['parent'] == failing and not failures:
+                failures.append(params['parent'])
+                raise Exception('Internal error')
+            return list_assets(params)
+
+        fake.listAssets = flaky_list_assets
+        with AssetInventory(self.path, data=fake) as inventory:
+            with self.assertRaises(Exception):
+                inventory.refresh(fake.root, max_workers=1)
+            inventory.refresh(fake.root)
+            self.check(fake, inventory)
+
+    def test_full_refresh_without_propagation(self):
+        fake = self.build(propagate_update_time=False)
+        with AssetInventory(self.path, data=fake) as inventory:
+            inventory.refresh(fake.root)
+            self.change_deep_assets(fake)
+            # The folders above the changes keep their updateTime, so an
+            # incremental refresh doesn't see them
+            inventory.refresh(fake.root)
+            self.assertNotEqual(snapshot(inventory.iter_assets(fake.root)),
+                                self.expected(fake))
+            inventory.refresh(fake.root, full=True)
+            self.check(fake, inventory)
+
+    def test_iter_tree_single_asset(self):
+        fake = self.build()
+        image = fake.children[fake.root + '/folder0/folder0/image_collection0'][0]
+        expected = snapshot(iter_tree(image, data=fake))
+        self.assertEqual(list(expected), [image])
+        self.assertEqual(snapshot(iter_tree(image, self.path, data=fake)), expected)
+
+    def test_iter_tree_matches_crawl(self):
+        fake = self.build()
+        for include_containers in [False, True]:
+            self.assertEqual(
+                snapshot(iter_tree(fake.root, self.path, include_containers=include_containers,
+                                   data=fake)),
+                snapshot(iter_tree(fake.root, include_containers=include_containers,
+                                   data=fake)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,45 +1,128 @@
+"""This script changes the permissions of all assets in a folder.
+
+The current ACL of every asset is read first and assets that already
+match the target ACL are skipped. Updates run on a pool of workers
+sharing a rate limit, and quota errors are retried with exponential
+backoff. Every finished asset is recorded in a journal file together
+with the target ACL, so an interrupted run can be started again with
+the same --journal and it resumes where it stopped. The journal is
+cleared when a run finishes without errors, so the next run checks
+every asset again.
+
+Usage:
+
+python update_acl.py --asset_folder <path to any asset folder> --journal acl_journal.txt
+"""
 import argparse
+import json
+import time
 import ee
+import ee_instrument
+from asset_inventory import iter_tree
+from bulk_requests import (Journal, LatencyStats, TokenBucket,
+                           call_with_retry, imap_bounded)
+
+
+def acl_matches(current, target):
+    """Check if all fields of the `target` ACL are already set."""
+    for key, value in target.items():
+        current_value = current.get(key)
+        if isinstance(value, list):
+            current_value = sorted(current_value or [])
+            value = sorted(value)
+        elif isinstance(value, bool):
+            current_value = bool(current_value)
+        if current_value != value:
+            return False
+    return True
+
+
+def journal_key(asset_id, acl_update):
+    """Journal entries are only reused for the same target ACL."""
+    return '{}\t{}'.format(asset_id, json.dumps(acl_update, sort_keys=True))
+
+
+def update_acls(assets, acl_update, journal, max_workers=8, rate=10,
+                retries=5, data=None):
+    """Set `acl_update` on every asset that doesn't already have it.
+
+    Assets recorded in the journal for the same `acl_update` are
+    skipped. The journal is cleared if no asset failed.
+    Returns a LatencyStats object with the outcome of every asset.
+    """
+    data = data or ee.data
+    limiter = TokenBucket(rate)
+    stats = LatencyStats()
+
+    def update(asset_id):
+        start = time.monotonic()
+        current = call_with_retry(data.getAssetAcl, asset_id, retries=retries,
+                                  limiter=limiter, on_retry=stats.add_retry)
+        if acl_matches(current, acl_update):
+            return 'skipped', time.monotonic() - start
+        call_with_retry(data.setAssetAcl, asset_id, acl_update, retries=retries,
+                        limiter=limiter, on_retry=stats.add_retry)
+        return 'updated', time.monotonic() - start
+
+    def todo():
+        for asset in assets:
+            if journal_key(asset['name'], acl_update) in journal.done:
+                stats.add('resumed')
+            else:
+                yield asset['name']
+
+    for asset_id, future in imap_bounded(update, todo(), max_workers):
+        try:
+            status, latency = future.result()
+        except Exception as error:
+            print('Failed to update {}: {}'.format(asset_id, error))
+            stats.add('failed')
+            continue
+        print('{} {}'.format(status.capitalize(), asset_id))
+        journal.record(journal_key(asset_id, acl_update), status)
+        stats.add(status, latency)
+    if not stats.counts['failed']:
+        journal.clear()
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--asset_folder', help='full path to the asset folder')
+    parser.add_argument('--max_workers', help='number of concurrent requests',
+                        type=int, default=8)
+    parser.add_argument('--inventory', help='path to a local SQLite asset inventory to '
+                        'refresh and read instead of crawling the whole folder')
+    parser.add_argument('--journal', help='checkpoint file used to resume an interrupted run',
+                        default='acl_journal.txt')
+    parser.add_argument('--rate', help='maximum number of requests per second',
+                        type=float, default=10)
+    parser.add_argument('--retries', help='number of retries on quota errors',
+                        type=int, default=5)
+    ee_instrument.add_arguments(parser)
+    args = parser.parse_args()
+    parent = args.asset_folder
+
+    # Replace the cloud_project with your own project
+    cloud_project = 'spatialthoughts'
+
+    try:
+        ee.Initialize(project=cloud_project)
+    except:
+        ee.Authenticate()
+        ee.Initialize(project=cloud_project)
+
+    ee_instrument.enable_from_args(args)
+
+    # Define update operations to perform
+    acl_update = {
+        'all_users_can_read': True
+    }
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--asset_folder', help='full path to the asset folder')
-args = parser.parse_args()
-parent = args.asset_folder
-
-# Replace the cloud_project with your own project
-cloud_project = 'spatialthoughts'
-
-try:
-    ee.Initialize(project=cloud_project)
-except:
-    ee.Authenticate()
-    ee.Initialize(project=cloud_project)
-
-def get_asset_list(parent):
-    parent_asset = ee.data.getAsset(parent)
-    parent_id = parent_asset['name']
-    parent_type = parent_asset['type']
-    asset_list = []
-    child_assets = ee.data.listAssets({'parent': parent_id})['assets']
-    for child_asset in child_assets:
-        child_id = child_asset['name']
-        child_type = child_asset['type']
-        if child_type in ['FOLDER','IMAGE_COLLECTION']:
-            # Recursively call the function to get child assets
-            asset_list.extend(get_asset_list(child_id))
-        else:
-            asset_list.append(child_id)
-    return asset_list
-    
-all_assets = get_asset_list(parent)
-
-print('Found {} assets'.format(len(all_assets)))
-
-# Define update operations to perform
-acl_update = {
-    'all_users_can_read': True
-}
-
-for asset in all_assets:
-     print('Updating permissions for {}'.format(asset))
-     ee.data.setAssetAcl(asset, acl_update)
\ No newline at end of file
+    assets = iter_tree(parent, inventory_path=args.inventory,
+                       max_workers=args.max_workers)
+    with Journal(args.journal) as journal:
+        stats = update_acls(assets, acl_update, journal,
+                            max_workers=args.max_workers, rate=args.rate,
+                            retries=args.retries)
+    print(stats.summary())
@@ -0,0 +1,137 @@
+# Script to prepare a folder of images for upload with geeup in one pass
+#
+# It replaces the steps of running rename_files.py, geeup getmeta and
+# update_metadata.py:
+# 1. The data folder is scanned once with os.scandir.
+# 2. All renames ('.' replaced with '_' in the filename) are planned up
+#    front. If two files would end up with the same name, or a new name
+#    is already taken, nothing is renamed and the collisions are listed.
+# 3. Renames are applied while recording each one in a journal file.
+#    The whole plan is written to disk before the first rename, so
+#    --rollback can undo all renames even after a crash.
+# 4. meta.csv is written with the id_no and system:time_start of
+#    every image, which is what geeup upload needs. It is prepared
+#    before the renames and only moved in place once they all succeeded.
+#
+# Usage:
+# python stage_upload.py --data_dir data --metadata meta.csv
+# python stage_upload.py --data_dir data --rollback
+import argparse
+import csv
+import os
+import pandas as pd
+from update_metadata import DATE_PATTERNS, get_time_start
+
+JOURNAL = 'rename_journal.tsv'
+
+
+def plan_renames(data_dir, extensions):
+    """Scan `data_dir` once and return (renames, names, collisions).
+
+    renames is a list of (old_name, new_name) for files that need a new
+    name, names is the final filename of every image and collisions is
+    a list of (new_name, [old_names]) that would clash.
+    """
+    renames = []
+    names = []
+    # Files that will end up with each new name. Files that keep their
+    # name are included, so renaming onto an existing file is a collision.
+    targets = {}
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            filename, extension = os.path.splitext(entry.name)
+            if extension.lower() not in extensions:
+                continue
+            new_name = filename.replace('.', '_') + extension
+            targets.setdefault(new_name, []).append(entry.name)
+            names.append(new_name)
+            if new_name != entry.name:
+                renames.append((entry.name, new_name))
+
+    collisions = [(new_name, old_names) for new_name, old_names in targets.items()
+                  if len(old_names) > 1]
+    return renames, names, collisions
+
+
+def apply_renames(data_dir, renames, journal_path):
+    # The plan is journaled with a single fsync. Rollback skips entries
+    # whose rename never happened.
+    with open(journal_path, 'a') as journal:
+        journal.writelines('{}\t{}\n'.format(old_name, new_name)
+                           for old_name, new_name in renames)
+        journal.flush()
+        os.fsync(journal.fileno())
+    for old_name, new_name in renames:
+        os.rename(os.path.join(data_dir, old_name),
+                  os.path.join(data_dir, new_name))
+
+
+def rollback(data_dir, journal_path):
+    with open(journal_path) as journal:
+        renames = [line.rstrip('\n').split('\t') for line in journal if line.strip()]
+    restored = 0
+    for old_name, new_name in reversed(renames):
+        old_path = os.path.join(data_dir, old_name)
+        new_path = os.path.join(data_dir, new_name)
+        if os.path.exists(new_path) and not os.path.exists(old_path):
+            os.rename(new_path, old_path)
+            restored += 1
+    os.remove(journal_path)
+    return restored
+
+
+def write_metadata(names, metadata_path, pattern, chunksize=100000):
+    """Write id_no and system:time_start, computing dates in chunks."""
+    with open(metadata_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id_no', 'system:time_start'])
+        for start in range(0, len(names), chunksize):
+            ids = pd.Series([os.path.splitext(name)[0]
+                             for name in names[start:start + chunksize]])
+            time_start = get_time_start(ids, pattern)
+            writer.writerows(zip(ids, time_start))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', help='folder with the images', default='data')
+    parser.add_argument('--metadata', help='metadata file to write', default='meta.csv')
+    parser.add_argument('--pattern', help='date pattern in the filename',
+                        choices=sorted(DATE_PATTERNS), default='YYYY_jjj')
+    parser.add_argument('--extensions', help='file extensions of the images',
+                        nargs='+', default=['.tif', '.tiff'])
+    parser.add_argument('--journal', help='file recording the renames', default=JOURNAL)
+    parser.add_argument('--rollback', help='undo the renames recorded in the journal',
+                        action='store_true')
+    args = parser.parse_args()
+
+    if args.rollback:
+        restored = rollback(args.data_dir, args.journal)
+        print('Restored {} files'.format(restored))
+    else:
+        extensions = set(extension.lower() for extension in args.extensions)
+        renames, names, collisions = plan_renames(args.data_dir, extensions)
+        if collisions:
+            for new_name, old_names in collisions:
+                print('Collision: {} <- {}'.format(new_name, ', '.join(old_names)))
+            raise SystemExit('Found {} collisions. No files were renamed.'.format(len(collisions)))
+        # Compute dates before renaming so an unexpected filename stops
+        # the script before anything is changed
+        temp_metadata = args.metadata + '.tmp'
+        try:
+            write_metadata(names, temp_metadata, args.pattern)
+        except Exception:
+            if os.path.exists(temp_metadata):
+                os.remove(temp_metadata)
+            raise
+        try:
+            apply_renames(args.data_dir, renames, args.journal)
+        except OSError:
+            os.remove(temp_metadata)
+            print('Renaming failed. Run with --rollback to undo the renames done so far.')
+            raise
+        os.replace(temp_metadata, args.metadata)
+        print('Renamed {} of {} files'.format(len(renames), len(names)))
+        print('Written {}'.format(args.metadata))
@@ -1,21 +1,110 @@
 # Script to extract image date from filename
 # and update the meta.csv file with system:time_start property
-import pandas as pd
+#
+# The date is extracted for all rows at once with str.extract and
+# converted to a timestamp with integer date arithmetic, so there is
+# no Python call per row. Months, days and days of the year out of
+# range are reported as errors. Use --chunksize to stream manifests that
+# don't fit in memory.
+#
+# Usage:
+# python update_metadata.py
+# python update_metadata.py --pattern YYYYMMDD --chunksize 1000000
+import argparse
+import os
 import re
+import numpy as np
+import pandas as pd
+
+# Supported date patterns in the filename
+# Each pattern captures year and either day-of-year or month (and day)
+DATE_PATTERNS = {
+    'YYYY_jjj': re.compile(r'(?P<year>\d{4})_(?P<doy>\d{3})'),
+    'YYYYjjj': re.compile(r'(?<!\d)(?P<year>\d{4})(?P<doy>\d{3})(?!\d)'),
+    'YYYYMMDD': re.compile(r'(?<!\d)(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})(?!\d)'),
+    'YYYY_MM': re.compile(r'(?P<year>\d{4})_(?P<month>\d{2})(?!\d)'),
+}
+
+MS_PER_DAY = 86400000
+
+
+def days_from_civil(year, month, day):
+    """Days since 1970-01-01 for arrays of proleptic Gregorian dates.
+
+    Integer-only algorithm from Howard Hinnant's date library.
+    """
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    yoe = year - era * 400
+    mp = (month + 9) % 12
+    doy = (153 * mp + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def get_time_start(names, pattern='YYYY_jjj'):
+    """Return system:time_start in milliseconds for a Series of names.
+
+    GEE expects dates in timestamp format.
+    """
+    parts = names.str.extract(DATE_PATTERNS[pattern])
+    if parts.isnull().any(axis=None):
+        bad = names[parts.isnull().any(axis=1)].iloc[0]
+        raise ValueError('No {} date found in {}'.format(pattern, bad))
+    parts = parts.astype('int64')
+    year = parts['year'].to_numpy()
+    ones = np.ones_like(year)
+    if 'doy' in parts:
+        doy = parts['doy'].to_numpy()
+        days = days_from_civil(year, ones, ones) + doy - 1
+        days_in_year = days_from_civil(year + 1, ones, ones) - days_from_civil(year, ones, ones)
+        invalid = (doy < 1) | (doy > days_in_year)
+    else:
+        month = parts['month'].to_numpy()
+        day = parts['day'].to_numpy() if 'day' in parts else ones
+        days = days_from_civil(year, month, day)
+        # Days in the month, valid for months 1-12 only
+        next_month = days_from_civil(year + month // 12, month % 12 + 1, ones)
+        invalid = ((month < 1) | (month > 12) | (day < 1) |
+                   (days >= next_month))
+    if invalid.any():
+        bad = names[invalid].iloc[0]
+        raise ValueError('Invalid {} date in {}'.format(pattern, bad))
+    return pd.Series(days * MS_PER_DAY, index=names.index)
+
+
+def update_metadata(input_file, output_file, pattern='YYYY_jjj', chunksize=None):
+    if not chunksize:
+        df = pd.read_csv(input_file, dtype={'id_no': str})
+        df['system:time_start'] = get_time_start(df['id_no'], pattern)
+        df.to_csv(output_file, index=False)
+        return len(df)
+
+    # Stream the manifest in chunks to a temporary file, so the
+    # input can be updated in place
+    temp_file = output_file + '.tmp'
+    rows = 0
+    for i, df in enumerate(pd.read_csv(input_file, dtype={'id_no': str},
+                                           chunksize=chunksize)):
+        df['system:time_start'] = get_time_start(df['id_no'], pattern)
+        df.to_csv(temp_file, index=False, mode='w' if i == 0 else 'a',
+                  header=(i == 0))
+        rows += len(df)
+    os.replace(temp_file, output_file)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', help='metadata file generated by geeup getmeta',
+                        default='meta.csv')
+    parser.add_argument('--output', help='output file, defaults to updating the input')
+    parser.add_argument('--pattern', help='date pattern in the filename',
+                        choices=sorted(DATE_PATTERNS), default='YYYY_jjj')
+    parser.add_argument('--chunksize', help='number of rows to process at a time',
+                        type=int, default=0)
+    args = parser.parse_args()
 
-filename = 'meta.csv'
-df = pd.read_csv(filename)
-
-def get_date_from_name(row):
-    name = row['id_no']
-    # Extract the year and doy from name 
-    # Date is a substring in YYYY_jjj format
-    matches = re.search(r'(\d{4})_(\d{3})', name)
-    year = int(matches.group(1))
-    doy = int(matches.group(2))
-    date = pd.to_datetime(year * 1000 + doy, format='%Y%j')
-    # GEE expects dates in timestamp format
-    return int(date.timestamp() * 1000)
-
-df['system:time_start'] = df.apply(get_date_from_name, axis=1)
-df.to_csv(filename, index=False)
+    rows = update_metadata(args.input, args.output or args.input,
+                           args.pattern, args.chunksize)
+    print('Updated {} rows'.format(rows))
@@ -0,0 +1,179 @@
+'''
+Streaming rainfall climatology from IMD Gridded Rainfall Data.
+
+Instead of loading all daily grids of the baseline period into one
+dataset, the daily data is read one year at a time and summed to an
+annual total. Annual totals are cached as small NetCDF files, and a
+per-pixel running mean and variance (Welford's algorithm) is kept in
+a state file together with the list of years it includes.
+
+Running the script again with a later --end_year only reads the new
+years. Changing the baseline adds or removes the years that differ
+using the cached annual totals, without reading the daily archive.
+
+Outputs (in --output_folder):
+- mean.tif: Mean annual rainfall over the baseline.
+- std.tif: Standard deviation of annual rainfall over the baseline.
+- anomaly_<year>.tif: Annual rainfall minus the mean, for each year
+  passed to --anomaly_years.
+
+Usage:
+
+python climatology.py --start_year 1971 --end_year 2004 --anomaly_years 2021
+'''
+import argparse
+import os
+import numpy as np
+import imdlib as imd
+import rioxarray
+import xarray as xr
+
+variable = 'rain'
+nodata = -999.
+
+
+class Climatology(object):
+    """Per-pixel running mean and variance of annual totals."""
+
+    def __init__(self, template):
+        # template is a 2D DataArray with lat/lon coordinates
+        self.template = template
+        self.count = np.zeros(template.shape, dtype='int32')
+        self.mean = np.zeros(template.shape, dtype='float64')
+        self.m2 = np.zeros(template.shape, dtype='float64')
+        self.years = set()
+
+    @classmethod
+    def load(cls, path):
+        ds = xr.open_dataset(path).load()
+        climatology = cls(ds['mean'])
+        climatology.count = ds['count'].values.astype('int32')
+        climatology.mean = ds['mean'].values.astype('float64')
+        climatology.m2 = ds['m2'].values.astype('float64')
+        climatology.years = set(int(y) for y in np.atleast_1d(ds.attrs['years']))
+        ds.close()
+        return climatology
+
+    def save(self, path):
+        ds = xr.Dataset({
+            'count': self.wrap(self.count),
+            'mean': self.wrap(self.mean),
+            'm2': self.wrap(self.m2),
+        })
+        ds.attrs['years'] = sorted(self.years)
+        temp_path = path + '.tmp'
+        ds.to_netcdf(temp_path)
+        os.replace(temp_path, path)
+
+    def wrap(self, values):
+        return xr.DataArray(values, coords=self.template.coords,
+                            dims=self.template.dims)
+
+    def add(self, year, total):
+        """Welford update with one year of annual totals. Pixels with no
+        data in that year are left unchanged."""
+        x = total.values.astype('float64')
+        valid = ~np.isnan(x)
+        self.count[valid] += 1
+        delta = np.where(valid, x - self.mean, 0)
+        self.mean[valid] += delta[valid] / self.count[valid]
+        self.m2[valid] += delta[valid] * (x[valid] - self.mean[valid])
+        self.years.add(year)
+
+    def remove(self, year, total):
+        """Reverse of add(), used to shrink the baseline."""
+        x = total.values.astype('float64')
+        valid = ~np.isnan(x) & (self.count > 0)
+        self.count[valid] -= 1
+        remaining = valid & (self.count > 0)
+        emptied = valid & (self.count == 0)
+        delta = np.where(remaining, x - self.mean, 0)
+        self.mean[remaining] -= delta[remaining] / self.count[remaining]
+        self.m2[remaining] -= delta[remaining] * (x[remaining] - self.mean[remaining])
+        self.mean[emptied] = 0
+        self.m2[emptied] = 0
+        self.years.discard(year)
+
+    def mean_raster(self):
+        return self.wrap(np.where(self.count > 0, self.mean, np.nan))
+
+    def std_raster(self):
+        # Sample standard deviation, needs at least 2 years
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+        return self.wrap(np.sqrt(np.maximum(variance, 0)))
+
+
+def annual_total(year, data_folder, cache_folder):
+    """Return the total rainfall of a year, reading the daily data only
+    if the annual total is not cached yet."""
+    cache_path = os.path.join(cache_folder, 'annual_{}.nc'.format(year))
+    if os.path.exists(cache_path):
+        with xr.open_dataarray(cache_path) as total:
+            return total.load()
+    grid_path = os.path.join(data_folder, variable, '{}.grd'.format(year))
+    if not os.path.exists(grid_path):
+        imd.get_data(variable, year, year, fn_format='yearwise', file_dir=data_folder)
+    data = imd.open_data(variable, year, year, 'yearwise', data_folder)
+    ds = data.get_xarray()
+    rain = ds[variable].where(ds[variable] != nodata)
+    # Keep pixels with no data for the whole year as NaN
+    total = rain.sum('time', min_count=1)
+    total.name = variable
+    total.to_netcdf(cache_path)
+    return total
+
+
+def write_raster(raster, path):
+    raster = raster.rio.set_spatial_dims('lon', 'lat')
+    raster = raster.rio.write_crs('EPSG:4326')
+    raster.rio.to_raster(path)
+    print('Successfully created GeoTIFF file', path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--start_year', help='first year of the baseline',
+                        type=int, default=1971)
+    parser.add_argument('--end_year', help='last year of the baseline',
+                        type=int, default=2004)
+    parser.add_argument('--anomaly_years', help='years to write anomaly rasters for',
+                        type=int, nargs='*', default=[])
+    parser.add_argument('--data_folder', help='folder with IMD yearwise grid files',
+                        default='data')
+    parser.add_argument('--output_folder', help='folder for the output GeoTIFF files',
+                        default='output')
+    parser.add_argument('--state_folder', help='folder for annual totals and climatology state',
+                        default='climatology_state')
+    args = parser.parse_args()
+
+    for folder in [args.data_folder, args.output_folder, args.state_folder]:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    state_path = os.path.join(args.state_folder, 'climatology.nc')
+    baseline = set(range(args.start_year, args.end_year + 1))
+
+    if os.path.exists(state_path):
+        climatology = Climatology.load(state_path)
+    else:
+        climatology = Climatology(annual_total(
+            args.start_year, args.data_folder, args.state_folder))
+
+    for year in sorted(climatology.years - baseline):
+        print('Removing', year)
+        climatology.remove(year, annual_total(year, args.data_folder, args.state_folder))
+    for year in sorted(baseline - climatology.years):
+        print('Adding', year)
+        climatology.add(year, annual_total(year, args.data_folder, args.state_folder))
+        # Save after every year so an interrupted run can continue
+        climatology.save(state_path)
+    climatology.save(state_path)
+
+    write_raster(climatology.mean_raster(), os.path.join(args.output_folder, 'mean.tif'))
+    write_raster(climatology.std_raster(), os.path.join(args.output_folder, 'std.tif'))
+    mean = climatology.mean_raster()
+    for year in args.anomaly_years:
+        total = annual_total(year, args.data_folder, args.state_folder)
+        anomaly = total - mean.values
+        write_raster(anomaly, os.path.join(args.output_folder, 'anomaly_{}.tif'.format(year)))
@@ -1,34 +1,153 @@
 '''
 Script to download GeoTIFF files of yearly rainfall
 from IMD Gridded Rainfall Data.
+
+Years are converted in parallel on a pool of worker processes. A year
+is skipped when its GeoTIFF is newer than its downloaded grid file, and
+only missing grid files are downloaded, so a run after a new year is
+released only processes that year. Use --force to rebuild everything.
+
+A yearly grid is small (about 25 MB for rainfall), so each worker
+reads it whole and computes the total with NumPy.
+
+The yearly GeoTIFFs can also be combined into time-stacked outputs
+that make per-pixel time series cheap to read:
+- cog: A single Cloud Optimized GeoTIFF with one band per year,
+  internally tiled, pixel interleaved and with overviews. One tile
+  read returns the whole time series of the pixels in it.
+- zarr: A Zarr store with chunks holding all years of a small block
+  of pixels.
+
+Usage:
+
+python download_all.py --workers 32
+
+python download_all.py --workers 32 --stack cog zarr
 '''
+import argparse
+import concurrent.futures
 import os
 import imdlib as imd
 import rioxarray as xr
+import xarray
 
 data_folder = r'C:\Users\ujava\Downloads\imd\data'
 output_folder = r'C:\Users\ujava\Downloads\imd\geotiff'
 
-if not os.path.exists(data_folder):
-    os.makedirs(data_folder)
-if not os.path.exists(output_folder):
-    os.makedirs(output_folder)
-    
 start_year = 1901
 end_year = 2021
 variable = 'rain' # other options are ('tmin'/ 'tmax')
-data = imd.get_data(variable, start_year, end_year, fn_format='yearwise', file_dir=data_folder)
 
-for year in range(start_year, end_year+1):
+
+def input_path(year):
+    # imdlib saves yearwise files as <file_dir>/<variable>/<year>.grd
+    return os.path.join(data_folder, variable, '{}.grd'.format(year))
+
+
+def output_path(year):
+    return os.path.join(output_folder, '{}.tif'.format(year))
+
+
+def is_up_to_date(year):
+    source = input_path(year)
+    target = output_path(year)
+    return (os.path.exists(source) and os.path.exists(target) and
+            os.path.getmtime(target) > os.path.getmtime(source))
+
+
+def write_stacked(years, formats, tile_size=256, zarr_chunk=32):
+    """Combine the yearly GeoTIFFs into time-stacked COG and/or Zarr outputs."""
+    rasters = []
+    for year in years:
+        raster = xr.open_rasterio(output_path(year), masked=True).squeeze('band', drop=True)
+        rasters.append(raster.expand_dims(year=[year]))
+    stacked = xarray.concat(rasters, dim='year')
+    name = '{}_{}_{}'.format(variable, years[0], years[-1])
+
+    if 'cog' in formats:
+        cog_path = os.path.join(output_folder, name + '.tif')
+        bands = stacked.rename({'year': 'band'})
+        bands = bands.rio.write_nodata(-999.0, encoded=True)
+        bands.attrs['long_name'] = [str(year) for year in years]
+        bands.rio.to_raster(
+            cog_path, driver='COG', compress='DEFLATE', predictor=3,
+            blocksize=tile_size, overviews='AUTO', interleave='PIXEL',
+            num_threads='ALL_CPUS')
+        print('Successfully created Cloud Optimized GeoTIFF', cog_path)
+
+    if 'zarr' in formats:
+        zarr_path = os.path.join(output_folder, name + '.zarr')
+        ds = stacked.to_dataset(name=variable)
+        # All years of a block of pixels are in one chunk
+        ds = ds.chunk({'year': -1, 'y': zarr_chunk, 'x': zarr_chunk})
+        ds.to_zarr(zarr_path, mode='w')
+        print('Successfully created Zarr store', zarr_path)
+
+
+def convert_year(year):
     data = imd.open_data(variable, year, year,'yearwise', data_folder)
     ds = data.get_xarray()
     ds = ds.where(ds['rain'] != -999.)
     total = ds.sum('time')
     total = total.rio.set_crs('EPSG:4326')
     total = total.rio.set_spatial_dims('lon', 'lat')
-    output_file = '{}.tif'.format(year)
-    output_path = os.path.join(output_folder, output_file)
-    total.rio.to_raster(output_path)
-    print('Successfully created GeoTIFF file', output_path)
-    
-    
+    # Write to a temporary file so an interrupted run never leaves a
+    # partial GeoTIFF that looks up to date
+    temp_path = output_path(year) + '.tmp'
+    total.rio.to_raster(temp_path, driver='GTiff')
+    os.replace(temp_path, output_path(year))
+    return output_path(year)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', help='number of worker processes',
+                        type=int, default=os.cpu_count())
+    parser.add_argument('--force', help='rebuild all GeoTIFF files',
+                        action='store_true')
+    parser.add_argument('--stack', help='also write time-stacked outputs',
+                        nargs='*', choices=['cog', 'zarr'], default=[])
+    parser.add_argument('--zarr_chunk', help='number of pixels along x and y per Zarr chunk',
+                        type=int, default=32)
+    args = parser.parse_args()
+
+    if not os.path.exists(data_folder):
+        os.makedirs(data_folder)
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    years = range(start_year, end_year+1)
+
+    # Download only the years that are not available locally
+    for year in years:
+        if not os.path.exists(input_path(year)):
+            imd.get_data(variable, year, year, fn_format='yearwise', file_dir=data_folder)
+
+    if args.force:
+        todo = list(years)
+    else:
+        todo = [year for year in years if not is_up_to_date(year)]
+    print('Converting {} of {} years'.format(len(todo), len(years)))
+
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(convert_year, year): year
+                   for year in todo}
+        for future in concurrent.futures.as_completed(futures):
+            year = futures[future]
+            try:
+                path = future.result()
+            except Exception as error:
+                print('Failed to convert {}: {}'.format(year, error))
+                failed.append(year)
+                continue
+            print('Successfully created GeoTIFF file', path)
+
+    if args.stack:
+        missing = sorted(set(failed) | set(
+            year for year in years if not os.path.exists(output_path(year))))
+        if missing:
+            print('Not writing time-stacked outputs, GeoTIFF files are missing '
+                  'for {} years: {}'.format(len(missing), ', '.join(map(str, missing))))
+        else:
+            write_stacked(list(years), args.stack, zarr_chunk=args.zarr_chunk)
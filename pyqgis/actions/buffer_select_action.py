@@ -1,3 +1,5 @@
+import qgis.utils
+
 line_layer = QgsProject.instance().mapLayer('[% @layer_id %]')
 polygon_layer_name = 'buildings'
 distance = 20
@@ -5,6 +7,45 @@ fid = [% $id %]
 line_feature = line_layer.getFeature(fid)
 line_geometry = line_feature.geometry().buffer(distance, 5)
 polygon_layer = QgsProject.instance().mapLayersByName(polygon_layer_name)[0]
-nearby_features = [p.id() for p in polygon_layer.getFeatures() 
-    if p.geometry().intersects(line_geometry) ]
+
+# The spatial index of the polygon layer is kept on qgis.utils so it
+# persists between clicks. It stores the geometries too, so no features
+# are read on a click. The index is dropped when the layer is edited or
+# removed and rebuilt on the next click.
+# Actions run in a namespace shared with other actions, so the layer
+# and its signals are captured in a function instead of globals.
+def cached_spatial_index(layer):
+    if not hasattr(qgis.utils, 'action_spatial_indexes'):
+        qgis.utils.action_spatial_indexes = {}
+    indexes = qgis.utils.action_spatial_indexes
+    layer_id = layer.id()
+    index = indexes.get(layer_id)
+    if index is not None:
+        return index
+    index = QgsSpatialIndex(layer.getFeatures(),
+                            flags=QgsSpatialIndex.FlagStoreFeatureGeometries)
+    indexes[layer_id] = index
+    signals = [layer.featureAdded, layer.featuresDeleted, layer.geometryChanged,
+               layer.afterCommitChanges, layer.afterRollBack,
+               layer.subsetStringChanged, layer.willBeDeleted]
+
+    def invalidate(*args):
+        if indexes.get(layer_id) is index:
+            del indexes[layer_id]
+        for signal in signals:
+            signal.disconnect(invalidate)
+
+    for signal in signals:
+        signal.connect(invalidate)
+    return index
+
+
+index = cached_spatial_index(polygon_layer)
+
+# Bounding box search in the index, then exact tests against the
+# prepared buffer
+engine = QgsGeometry.createGeometryEngine(line_geometry.constGet())
+engine.prepareGeometry()
+nearby_features = [candidate for candidate in index.intersects(line_geometry.boundingBox())
+    if engine.intersects(index.geometry(candidate).constGet())]
 polygon_layer.selectByIds(nearby_features)
\ No newline at end of file
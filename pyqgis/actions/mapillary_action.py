@@ -1,25 +1,59 @@
-import requests
+import os
+import sys
+import qgis.utils
 from qgis.PyQt.QtCore import QUrl
 from qgis.PyQt.QtWebKitWidgets import QWebView
+from qgis.core import (QgsApplication, QgsCoordinateReferenceSystem,
+                       QgsCoordinateTransform, QgsPointXY, QgsProject, QgsTask)
 from qgis.utils import iface
 
 # https://www.mapillary.com/developer/api-documentation#image
+# The lookup and the cache are in mapillary_lookup.py
 
-parameters = {
-    'access_token': '<access token>',
-    'bbox': '{},{},{},{}'.format([%$x%]-0.001,[%$y%]-0.001, [%$x%]+0.001, [%$y%]+0.001),
-    'fields': 'thumb_1024_url',
-	'limit': 1
-}
-
-response = requests.get(
-        'https://graph.mapillary.com/images', params=parameters)
-if response.status_code == 200:
-    data_json = response.json()
-    if data_json['data']:
-        url = data_json['data'][0]['thumb_1024_url']
-        myWV = QWebView(None)
-        myWV.load(QUrl(url))
-        myWV.show()
+access_token = '<access token>'
+# Folder containing mapillary_lookup.py
+scripts_folder = os.path.expanduser('~/projects/pyqgis')
+cache_dir = os.path.join(os.path.expanduser('~'), '.mapillary_cache')
+
+# The cache is keyed on EPSG:4326 coordinates, like in mapillary_prewarm.py
+layer = QgsProject.instance().mapLayer('[% @layer_id %]')
+transform = QgsCoordinateTransform(layer.crs(), QgsCoordinateReferenceSystem('EPSG:4326'),
+                                   QgsProject.instance())
+point = transform.transform(QgsPointXY([%$x%], [%$y%]))
+x = point.x()
+y = point.y()
+
+if scripts_folder not in sys.path:
+    sys.path.append(scripts_folder)
+from mapillary_lookup import MapillaryLookup
+
+# The lookup is kept on qgis.utils so the HTTP session and the cache
+# are reused between clicks
+if not hasattr(qgis.utils, 'mapillary_lookup'):
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    qgis.utils.mapillary_lookup = MapillaryLookup(access_token, cache_dir)
+lookup = qgis.utils.mapillary_lookup
+
+
+def fetch(task, x, y):
+    return lookup.thumbnail(x, y)
+
+
+def show(exception, path=None):
+    if exception is not None:
+        iface.messageBar().pushWarning('Mapillary', 'Request failed: {}'.format(exception))
+    elif path is None:
+        iface.messageBar().pushMessage('No images found')
     else:
-        qgis.utils.iface.messageBar().pushMessage('No images found')
+        view = QWebView(None)
+        view.load(QUrl.fromLocalFile(path))
+        view.show()
+        # Keep a reference so the window stays open
+        qgis.utils.mapillary_view = view
+
+
+# The request runs in a background task so QGIS doesn't freeze
+task = QgsTask.fromFunction('Mapillary lookup', fetch, x, y, on_finished=show)
+qgis.utils.mapillary_task = task
+QgsApplication.taskManager().addTask(task)
@@ -1,8 +1,138 @@
+import os
+from collections import OrderedDict
+import qgis.utils
 from qgis.utils import iface
+from PyQt5.QtCore import QCoreApplication, QFileInfo
+
+# Loaded tiles are limited by count and by size on disk. When a limit
+# is reached, the least recently clicked tiles are unloaded.
+max_tiles = 20
+max_bytes = 2 * 1024 ** 3
+# Tiles next to the clicked one are opened in the background, so they
+# load instantly when clicked
+prefetch_neighbors = True
 
 path = r'[%location%]'
-iface.addRasterLayer(path)
+fid = [% $id %]
 
 index_layer_name = 'index'
+location_field = 'location'
 index_layer = QgsProject.instance().mapLayersByName(index_layer_name)[0]
+
+
+class PrefetchTask(QgsTask):
+    """Opens a raster layer in a background thread."""
+
+    def __init__(self, manager, path):
+        super().__init__('Prefetch {}'.format(QFileInfo(path).baseName()), QgsTask.CanCancel)
+        self.manager = manager
+        self.path = path
+        self.layer = None
+
+    def run(self):
+        layer = QgsRasterLayer(self.path, QFileInfo(self.path).baseName())
+        if not layer.isValid() or self.isCanceled():
+            return False
+        # Layers must belong to the main thread to be added to the project
+        layer.moveToThread(QCoreApplication.instance().thread())
+        self.layer = layer
+        return True
+
+    def finished(self, result):
+        self.manager.prefetched(self.path, self.layer if result else None)
+
+
+class TileManager:
+    """Keeps a bounded LRU set of tiles loaded in the project."""
+
+    def __init__(self, index_layer, location_field):
+        self.index_layer = index_layer
+        self.index_layer_id = index_layer.id()
+        self.location_field = location_field
+        self.max_tiles = max_tiles
+        self.max_bytes = max_bytes
+        # path -> (layer id, size in bytes), least recently used first
+        self.loaded = OrderedDict()
+        # Prefetched layers that are not in the project yet
+        self.ready = OrderedDict()
+        self.tasks = {}
+        self.index = None
+        QgsProject.instance().layersWillBeRemoved.connect(self.forget)
+
+    def close(self):
+        QgsProject.instance().layersWillBeRemoved.disconnect(self.forget)
+
+    def load(self, path):
+        if path in self.loaded:
+            self.loaded.move_to_end(path)
+            return
+        layer = self.ready.pop(path, None)
+        if layer is None:
+            layer = QgsRasterLayer(path, QFileInfo(path).baseName())
+        QgsProject.instance().addMapLayer(layer)
+        self.loaded[path] = (layer.id(), os.path.getsize(path) if os.path.exists(path) else 0)
+        self.evict()
+
+    def evict(self):
+        # Always keep the tile that was just loaded
+        while len(self.loaded) > 1 and (
+                len(self.loaded) > self.max_tiles or
+                sum(size for _, size in self.loaded.values()) > self.max_bytes):
+            _, (layer_id, _) = self.loaded.popitem(last=False)
+            QgsProject.instance().removeMapLayer(layer_id)
+
+    def remove(self, path):
+        if path in self.loaded:
+            layer_id, _ = self.loaded.pop(path)
+            QgsProject.instance().removeMapLayer(layer_id)
+            return True
+        return False
+
+    def forget(self, layer_ids):
+        # Tiles removed from the Layers panel are no longer tracked
+        for path, (layer_id, _) in list(self.loaded.items()):
+            if layer_id in layer_ids:
+                del self.loaded[path]
+
+    def neighbors(self, fid):
+        if self.index is None:
+            self.index = QgsSpatialIndex(self.index_layer.getFeatures())
+        feature = self.index_layer.getFeature(fid)
+        ids = [i for i in self.index.intersects(feature.geometry().boundingBox()) if i != fid]
+        request = QgsFeatureRequest().setFilterFids(ids).setFlags(QgsFeatureRequest.NoGeometry)
+        return [f[self.location_field] for f in self.index_layer.getFeatures(request)]
+
+    def prefetch(self, fid):
+        paths = [path for path in self.neighbors(fid)
+                 if path not in self.loaded and path not in self.ready and path not in self.tasks]
+        for path in paths:
+            task = PrefetchTask(self, path)
+            # Keep a reference, otherwise the task is garbage collected
+            self.tasks[path] = task
+            QgsApplication.taskManager().addTask(task)
+
+    def prefetched(self, path, layer):
+        self.tasks.pop(path, None)
+        if layer is None:
+            return
+        self.ready[path] = layer
+        # Only keep the neighbors of the last few clicks
+        while len(self.ready) > 16:
+            self.ready.popitem(last=False)
+
+
+# The tile manager is kept on qgis.utils so it persists between clicks.
+# A new one is created when the index layer is reloaded.
+manager = getattr(qgis.utils, 'tile_manager', None)
+if manager is None or manager.index_layer_id != index_layer.id():
+    if manager is not None:
+        manager.close()
+    manager = qgis.utils.tile_manager = TileManager(index_layer, location_field)
+manager.max_tiles = max_tiles
+manager.max_bytes = max_bytes
+
+manager.load(path)
+if prefetch_neighbors:
+    manager.prefetch(fid)
+
 iface.setActiveLayer(index_layer)
@@ -1,9 +1,16 @@
+import qgis.utils
 from qgis.utils import iface
 from PyQt5.QtCore import QFileInfo
 
 path = r'[%location%]'
-layer_name = QFileInfo(path).baseName()
-layer_list = QgsProject.instance().mapLayersByName(layer_name)
-if layer_list:
-    QgsProject.instance().removeMapLayer(layer_list[0])
+
+# Tiles loaded by tileindex_load.py are tracked by its tile manager
+manager = getattr(qgis.utils, 'tile_manager', None)
+if manager is not None and manager.remove(path):
     iface.mapCanvas().refresh()
+else:
+    layer_name = QFileInfo(path).baseName()
+    layer_list = QgsProject.instance().mapLayersByName(layer_name)
+    if layer_list:
+        QgsProject.instance().removeMapLayer(layer_list[0])
+        iface.mapCanvas().refresh()
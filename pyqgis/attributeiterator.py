@@ -11,23 +11,105 @@
 ***************************************************************************
 """
 
-from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
 from qgis.core import (QgsProcessing,
                        QgsFeatureSink,
+                       QgsFeatureRequest,
+                       NULL,
+                       QgsDataSourceUri,
+                       QgsProviderRegistry,
+                       QgsTransaction,
                        QgsProcessingException,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterNumber,
                        QgsProcessingOutputVectorLayer)
 from qgis import processing
+import time
+
+# Backends where indexes are created with SQL in a single transaction
+SQLITE_STORAGE_TYPES = ('GPKG', 'SQLite')
+
+# Field types an attribute index can't be built on
+UNINDEXABLE_TYPES = (QVariant.ByteArray, QVariant.Map, QVariant.List,
+                     QVariant.StringList)
+
+# Text fields where every sampled value is unique and longer than this
+# on average are treated as free text, not worth an index
+MAX_UNIQUE_TEXT_LENGTH = 64
+
+
+def quote(identifier):
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def sql_backend(layer):
+    """Return 'sqlite', 'postgres' or None if indexes can't be built with SQL."""
+    provider = layer.providerType()
+    if provider == 'postgres':
+        return 'postgres'
+    if provider == 'spatialite':
+        return 'sqlite'
+    if provider == 'ogr' and layer.dataProvider().storageType() in SQLITE_STORAGE_TYPES:
+        return 'sqlite'
+    return None
+
+
+def table_name(layer):
+    """Return (schema, table) of the layer in its database."""
+    if layer.providerType() == 'ogr':
+        parts = QgsProviderRegistry.instance().decodeUri('ogr', layer.source())
+        return None, parts.get('layerName')
+    uri = QgsDataSourceUri(layer.source())
+    return uri.schema() or None, uri.table()
+
+
+def indexed_fields(layer, backend):
+    """Return the names of fields that are the first column of an index."""
+    schema, table = table_name(layer)
+    if not table:
+        return set()
+    if backend == 'sqlite':
+        # An INTEGER PRIMARY KEY (like the fid of a GeoPackage) is the
+        # rowid and has no entry in the index list
+        sql = ("SELECT ii.name FROM pragma_index_list('{0}') AS il "
+               "JOIN pragma_index_info(il.name) AS ii WHERE ii.seqno = 0 "
+               "UNION SELECT name FROM pragma_table_info('{0}') WHERE pk = 1").format(
+                   table.replace("'", "''"))
+    else:
+        relation = quote(table) if not schema else '{}.{}'.format(quote(schema), quote(table))
+        sql = ("SELECT a.attname FROM pg_index i JOIN pg_attribute a "
+               "ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0] "
+               "WHERE i.indrelid = '{}'::regclass").format(relation.replace("'", "''"))
+    if layer.providerType() == 'ogr':
+        uri = QgsProviderRegistry.instance().decodeUri('ogr', layer.source())['path']
+    else:
+        uri = layer.source()
+    metadata = QgsProviderRegistry.instance().providerMetadata(layer.providerType())
+    try:
+        connection = metadata.createConnection(uri, {})
+        return set(row[0] for row in connection.executeSql(sql))
+    except Exception:
+        return set()
 
 
 class AttributeIterator(QgsProcessingAlgorithm):
     """
     This algorithm takes a vector layer and iterates through its attributes to
     create attribute indices.
+
+    Fields that already have an index, including the primary key, are
+    skipped. The first features of the layer are read to skip fields where
+    an index doesn't help: constant or empty columns and free text where
+    every value is unique. Constant columns are confirmed on the whole
+    layer, but unique free text is only detected in the features read, so
+    raise the sample size for layers sorted on a text field. On GeoPackage,
+    SpatiaLite and PostgreSQL layers all indexes are created in a single
+    transaction.
     """
 
     INPUT = 'INPUT'
+    SAMPLE_SIZE = 'SAMPLE_SIZE'
     OUTPUT = 'OUTPUT'
 
     def tr(self, string):
@@ -50,7 +132,10 @@ class AttributeIterator(QgsProcessingAlgorithm):
         return ''
 
     def shortHelpString(self):
-        return self.tr("Create Attribute Indices on All Attributes of the Layer")
+        return self.tr("Create Attribute Indices on All Attributes of the Layer. "
+                       "Fields that are already indexed, constant or unique free "
+                       "text are skipped. Unique free text is detected in the first "
+                       "features of the layer, up to the sample size.")
 
     def initAlgorithm(self, config=None):
         self.addParameter(
@@ -61,6 +146,15 @@ class AttributeIterator(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.SAMPLE_SIZE,
+                self.tr('Number of features sampled to check field values'),
+                QgsProcessingParameterNumber.Integer,
+                10000, False, 1
+            )
+        )
+
         self.addOutput(
             QgsProcessingOutputVectorLayer(
                 self.OUTPUT,
@@ -78,10 +172,128 @@ class AttributeIterator(QgsProcessingAlgorithm):
         if source is None:
             raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
         
-        fields = source.fields()
-        for field in fields.names():
-            feedback.pushInfo('Indexing field {}'.format(field))
-            params = {'INPUT': source,'FIELD': field}
-            processing.run("native:createattributeindex", params)
-        
+        sample_size = self.parameterAsInt(parameters, self.SAMPLE_SIZE, context)
+
+        backend = sql_backend(source)
+        existing = indexed_fields(source, backend) if backend else set()
+        # Primary keys are always indexed
+        existing |= set(source.fields().at(index).name()
+                        for index in source.dataProvider().pkAttributeIndexes())
+        fields = self.selectFields(source, existing, sample_size, feedback)
+        if not fields:
+            feedback.pushInfo('No fields to index')
+            return {self.OUTPUT: source.id()}
+
+        if backend is None or not self.indexWithTransaction(source, backend, fields, feedback):
+            self.indexWithProcessing(source, fields, context, feedback)
+
         return {self.OUTPUT: source.id()}
+
+    def selectFields(self, source, existing, sample_size, feedback):
+        """Return the names of the fields worth indexing."""
+        candidates = []
+        for index, field in enumerate(source.fields()):
+            if field.name() in existing:
+                feedback.pushInfo('Skipping field {}: already indexed'.format(field.name()))
+            elif field.type() in UNINDEXABLE_TYPES:
+                feedback.pushInfo('Skipping field {}: unsupported type'.format(field.name()))
+            else:
+                candidates.append((index, field))
+        if not candidates:
+            return []
+
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes([index for index, _ in candidates])
+        request.setLimit(sample_size)
+        values = {index: set() for index, _ in candidates}
+        lengths = {index: 0 for index, _ in candidates}
+        counts = {index: 0 for index, _ in candidates}
+        sampled = 0
+        for feature in source.getFeatures(request):
+            if feedback.isCanceled():
+                return []
+            sampled += 1
+            for index, _ in candidates:
+                value = feature.attribute(index)
+                if value is None or value == NULL:
+                    continue
+                values[index].add(value)
+                counts[index] += 1
+                if isinstance(value, str):
+                    lengths[index] += len(value)
+
+        fields = []
+        for index, field in candidates:
+            distinct = len(values[index])
+            if distinct <= 1 and sampled >= sample_size:
+                # The sample is the first features, which can all have the
+                # same value on a sorted layer, so check the whole layer
+                distinct = len(source.uniqueValues(index, 2))
+            if distinct <= 1:
+                feedback.pushInfo('Skipping field {}: constant or empty'.format(
+                    field.name()))
+            elif (field.type() == QVariant.String and distinct == counts[index] and
+                    lengths[index] / counts[index] > MAX_UNIQUE_TEXT_LENGTH):
+                feedback.pushInfo('Skipping field {}: unique free text'.format(field.name()))
+            else:
+                fields.append(field.name())
+        return fields
+
+    def indexWithTransaction(self, source, backend, fields, feedback):
+        """Create all indexes in one transaction. Returns False if the
+        backend doesn't support it, so the caller can fall back."""
+        schema, table = table_name(source)
+        if not table or not QgsTransaction.supportsTransaction({source}):
+            return False
+        transaction = QgsTransaction.create({source})
+        if transaction is None:
+            return False
+        ok, error = transaction.begin()
+        if not ok:
+            feedback.pushInfo('Could not start a transaction: {}'.format(error))
+            return False
+
+        relation = quote(table) if not schema else '{}.{}'.format(quote(schema), quote(table))
+        start = time.perf_counter()
+        for i, field in enumerate(fields):
+            if feedback.isCanceled():
+                transaction.rollback()
+                return True
+            index_name = 'idx_{}_{}'.format(table, field)
+            sql = 'CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                quote(index_name), relation, quote(field))
+            field_start = time.perf_counter()
+            ok, error = transaction.executeSql(sql)
+            if not ok:
+                transaction.rollback()
+                feedback.reportError('Failed to index field {}: {}'.format(field, error))
+                return False
+            feedback.pushInfo('Indexed field {} in {:.2f}s'.format(
+                field, time.perf_counter() - field_start))
+            feedback.setProgress(100 * (i + 1) / len(fields))
+
+        commit_start = time.perf_counter()
+        ok, error = transaction.commit()
+        if not ok:
+            raise QgsProcessingException('Failed to commit indexes: {}'.format(error))
+        feedback.pushInfo('Committed {} indexes in {:.2f}s ({:.2f}s total)'.format(
+            len(fields), time.perf_counter() - commit_start, time.perf_counter() - start))
+        return True
+
+    def indexWithProcessing(self, source, fields, context, feedback):
+        # Other backends (e.g. shapefiles) keep attribute indexes in a single
+        # file per layer, so fields are indexed one at a time
+        start = time.perf_counter()
+        for i, field in enumerate(fields):
+            if feedback.isCanceled():
+                break
+            field_start = time.perf_counter()
+            params = {'INPUT': source,'FIELD': field}
+            processing.run("native:createattributeindex", params,
+                           context=context, is_child_algorithm=True)
+            feedback.pushInfo('Indexed field {} in {:.2f}s'.format(
+                field, time.perf_counter() - field_start))
+            feedback.setProgress(100 * (i + 1) / len(fields))
+        feedback.pushInfo('Indexed {} fields in {:.2f}s'.format(
+            len(fields), time.perf_counter() - start))
@@ -0,0 +1,149 @@
+"""Benchmark numpy_rastercalculator.py against the QGIS Raster Calculator
+
+Two synthetic Float32 rasters of --size x --size pixels are created
+(tiled and compressed) and (A - B) / (A + B) is computed with:
+- numpy: numpy_rastercalculator.calculate
+- qgis: the built-in qgis:rastercalculator algorithm
+
+Each calculator runs in its own process so the peak memory reported is
+for that run only. Run the script with the Python environment of QGIS
+(e.g. the OSGeo4W Shell on Windows). Peak memory is not available on
+Windows. The synthetic rasters are kept in --workdir and reused.
+
+Usage:
+
+python benchmark_rastercalculator.py --size 50000 --workdir bench
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from osgeo import gdal, osr
+
+EXPRESSIONS = {
+    'numpy': '(A - B) / (A + B)',
+    'qgis': '("a@1" - "b@1") / ("a@1" + "b@1")',
+}
+
+
+def make_raster(path, size, seed, tile=512):
+    """Write a tiled Float32 GeoTIFF with a gradient plus noise."""
+    driver = gdal.GetDriverByName('GTiff')
+    dataset = driver.Create(path, size, size, 1, gdal.GDT_Float32,
+                            options=['TILED=YES', 'BLOCKXSIZE={}'.format(tile),
+                                     'BLOCKYSIZE={}'.format(tile), 'COMPRESS=DEFLATE',
+                                     'BIGTIFF=YES'])
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32643)
+    dataset.SetProjection(srs.ExportToWkt())
+    dataset.SetGeoTransform((500000, 10, 0, 2000000, 0, -10))
+    band = dataset.GetRasterBand(1)
+    rng = np.random.default_rng(seed)
+    for yoff in range(0, size, tile):
+        rows = min(tile, size - yoff)
+        y = np.arange(yoff, yoff + rows, dtype='float32')[:, None]
+        for xoff in range(0, size, tile):
+            columns = min(tile, size - xoff)
+            x = np.arange(xoff, xoff + columns, dtype='float32')[None, :]
+            gradient = ((x + y) % 1000) / 1000
+            noise = rng.random((rows, columns), dtype='float32')
+            band.WriteArray(gradient + noise + 0.1, xoff, yoff)
+    band = None
+    dataset = None
+
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def run_numpy(inputs, output, threads):
+    from numpy_rastercalculator import calculate
+    calculate(inputs, EXPRESSIONS['numpy'], output, threads=threads)
+
+
+def run_qgis(inputs, output, threads):
+    from qgis.core import QgsApplication, QgsRasterLayer
+    application = QgsApplication([], False)
+    application.initQgis()
+    sys.path.append(os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins'))
+    from processing.core.Processing import Processing
+    import processing
+    Processing.initialize()
+    layers = [QgsRasterLayer(path, name) for path, name in zip(inputs, ['a', 'b'])]
+    params = {
+        'CELLSIZE': 0,
+        'CRS': None,
+        'EXPRESSION': EXPRESSIONS['qgis'],
+        'EXTENT': None,
+        'LAYERS': layers,
+        'OUTPUT': output,
+    }
+    processing.run('qgis:rastercalculator', params)
+
+
+def main():
+    # Only when run as a script. Processing loads the scripts in this
+    # folder, and the setting would apply to all of QGIS
+    gdal.UseExceptions()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', help='width and height of the synthetic rasters',
+                        type=int, default=50000)
+    parser.add_argument('--workdir', help='folder for the rasters', default='bench')
+    parser.add_argument('--threads', help='threads for the NumPy calculator',
+                        type=int, default=os.cpu_count())
+    parser.add_argument('--calculators', help='calculators to run', nargs='+',
+                        choices=sorted(EXPRESSIONS), default=['numpy', 'qgis'])
+    parser.add_argument('--run', help=argparse.SUPPRESS, choices=sorted(EXPRESSIONS))
+    args = parser.parse_args()
+
+    inputs = [os.path.join(args.workdir, '{}_{}.tif'.format(name, args.size))
+              for name in ['a', 'b']]
+
+    if args.run:
+        # Child process running a single calculator
+        output = os.path.join(args.workdir, '{}_{}_output.tif'.format(args.run, args.size))
+        if os.path.exists(output):
+            os.remove(output)
+        start = time.perf_counter()
+        {'numpy': run_numpy, 'qgis': run_qgis}[args.run](inputs, output, args.threads)
+        print(json.dumps({'seconds': time.perf_counter() - start,
+                          'peak_mb': peak_memory_mb()}))
+        return
+
+    if not os.path.exists(args.workdir):
+        os.makedirs(args.workdir)
+    for seed, path in enumerate(inputs):
+        if not os.path.exists(path):
+            print('Creating', path)
+            make_raster(path, args.size, seed)
+
+    header = '{:<12} {:>10} {:>10} {:>12}'.format('calculator', 'seconds', 'Mpixel/s', 'peak MB')
+    print(header)
+    print('-' * len(header))
+    megapixels = args.size * args.size / 1e6
+    for calculator in args.calculators:
+        command = [sys.executable, os.path.abspath(__file__), '--size', str(args.size),
+                   '--workdir', os.path.abspath(args.workdir), '--threads', str(args.threads),
+                   '--run', calculator]
+        result = subprocess.run(command, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode != 0:
+            print('{:<12} failed: {}'.format(calculator, result.stderr.strip()))
+            continue
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        peak = '{:.0f}'.format(stats['peak_mb']) if stats['peak_mb'] else 'n/a'
+        print('{:<12} {:>10.1f} {:>10.1f} {:>12}'.format(
+            calculator, stats['seconds'], megapixels / stats['seconds'], peak))
+
+
+if __name__ == '__main__':
+    main()
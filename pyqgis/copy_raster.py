@@ -1,19 +1,40 @@
 """Processing Script to demonstrate how to copy a raster layer.
 
 A use case of this is detailed at https://gis.stackexchange.com/questions/416616/feed-an-existing-raster-to-qgis-raster-destination-parameter-in-qgis-processing
-"""
 
+The copy can be made in one of these modes:
+- GeoTIFF: A plain copy with gdal_translate.
+- Cloud Optimized GeoTIFF: A tiled and compressed COG with overviews.
+  Encoding and overview generation use all CPUs.
+- Virtual raster (VRT): A small VRT file that references the input.
+- Hardlink: A hard link to the input file, or a file copy if a link
+  can't be made. Only available when the output has the same format
+  as the input. A hard link shares its storage with the input, so
+  editing the output in place also changes the original.
+
+GDAL reports progress to the Processing dialog and the copy can be
+cancelled.
+"""
+import os
+import shutil
+from osgeo import gdal
 from qgis.core import (QgsProcessing,
                        QgsRasterLayer,
+                       QgsProcessingException,
                        QgsProcessingAlgorithm,
+                       QgsProcessingParameterEnum,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterRasterDestination)
-from qgis import processing
 
 
 class CopyRasterAlgorithm(QgsProcessingAlgorithm):
     INPUT_RASTER = 'INPUT_RASTER'
+    MODE = 'MODE'
+    COMPRESSION = 'COMPRESSION'
     OUTPUT = 'OUTPUT'
+
+    MODES = ['GeoTIFF', 'Cloud Optimized GeoTIFF', 'Virtual raster (VRT)', 'Hardlink']
+    COMPRESSIONS = ['DEFLATE', 'LZW', 'ZSTD', 'NONE']
     
     def createInstance(self):
         return CopyRasterAlgorithm()
@@ -24,6 +45,11 @@ class CopyRasterAlgorithm(QgsProcessingAlgorithm):
     def displayName(self):
         return 'copyraster'
 
+    def shortHelpString(self):
+        return ('Copies a raster as a GeoTIFF, a Cloud Optimized GeoTIFF, a VRT or a hard '
+                'link. A hard link shares its storage with the input, so editing the '
+                'output in place also changes the original.')
+
     def initAlgorithm(self, config=None):
        
         self.addParameter(
@@ -34,6 +60,24 @@ class CopyRasterAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.MODE,
+                'Copy mode',
+                options=self.MODES,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.COMPRESSION,
+                'Compression (Cloud Optimized GeoTIFF)',
+                options=self.COMPRESSIONS,
+                defaultValue=0
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterRasterDestination(
                   self.OUTPUT,
@@ -43,11 +87,75 @@ class CopyRasterAlgorithm(QgsProcessingAlgorithm):
 
     def processAlgorithm(self, parameters, context, feedback):
         inputraster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
-     
-        params = {
-            'INPUT':inputraster,
-            'OUTPUT': parameters['OUTPUT']
-        }
-        result = processing.run("gdal:translate", params, context=context)
+        mode = self.MODES[self.parameterAsEnum(parameters, self.MODE, context)]
+        compression = self.COMPRESSIONS[
+            self.parameterAsEnum(parameters, self.COMPRESSION, context)]
+        output = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+        source = inputraster.source()
+
+        if mode == 'Hardlink':
+            return {self.OUTPUT: self.link(source, output, feedback)}
+
+        # The output path is already registered to be loaded, so it can't
+        # be changed here
+        extension = os.path.splitext(output)[1].lower()
+        extensions = ['.vrt'] if mode == 'Virtual raster (VRT)' else ['.tif', '.tiff']
+        if extension not in extensions:
+            raise QgsProcessingException('{} mode needs a {} output file, got {}'.format(
+                mode, ' or '.join(extensions), output))
+
+        def progress(complete, message, data):
+            feedback.setProgress(complete * 100)
+            # Returning 0 stops GDAL
+            return 0 if feedback.isCanceled() else 1
+
+        if mode == 'Cloud Optimized GeoTIFF':
+            options = gdal.TranslateOptions(
+                format='COG',
+                creationOptions=['COMPRESS={}'.format(compression),
+                                 'BLOCKSIZE=512',
+                                 'OVERVIEWS=AUTO',
+                                 'NUM_THREADS=ALL_CPUS',
+                                 'BIGTIFF=IF_SAFER'],
+                callback=progress)
+        elif mode == 'Virtual raster (VRT)':
+            options = gdal.TranslateOptions(format='VRT', callback=progress)
+        else:
+            options = gdal.TranslateOptions(format='GTiff', callback=progress)
+
+        dataset = gdal.Translate(output, source, options=options)
+        if dataset is None:
+            if feedback.isCanceled():
+                return {}
+            raise QgsProcessingException('Failed to copy {}: {}'.format(
+                source, gdal.GetLastErrorMsg()))
+        dataset = None
     
-        return {self.OUTPUT: result['OUTPUT']}
\ No newline at end of file
+        return {self.OUTPUT: output}
+
+    def link(self, source, output, feedback):
+        if not os.path.isfile(source):
+            raise QgsProcessingException(
+                'Hardlink mode needs a file based input, got {}'.format(source))
+        if os.path.splitext(source)[1].lower() != os.path.splitext(output)[1].lower():
+            raise QgsProcessingException(
+                'Hardlink mode needs the output to have the same format as the input')
+        if os.path.exists(output):
+            if os.path.samefile(source, output):
+                if os.path.normcase(os.path.realpath(source)) == \
+                        os.path.normcase(os.path.realpath(output)):
+                    raise QgsProcessingException(
+                        'Hardlink mode needs an output different from the input')
+                # Already a hard link to the input
+                feedback.setProgress(100)
+                return output
+            os.remove(output)
+        try:
+            os.link(source, output)
+            feedback.pushInfo('Created hard link {}'.format(output))
+        except OSError:
+            # e.g. the output is on a different drive
+            shutil.copyfile(source, output)
+            feedback.pushInfo('Could not create a hard link, copied to {}'.format(output))
+        feedback.setProgress(100)
+        return output
@@ -1,25 +1,117 @@
 import ee
-from ee_plugin import Map
 import json
+import math
+import time
+import urllib.parse
+from collections import OrderedDict
+import qgis.utils
+from qgis.PyQt.QtCore import QTimer
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform,
+                       QgsProject, QgsRasterLayer)
 
-ee.Initialize()
-
-bounds = iface.mapCanvas().extent()
-xMin = bounds.xMinimum()
-yMin = bounds.yMinimum()
-xMax = bounds.xMaximum()
-yMax = bounds.yMaximum()
-geometry = ee.Geometry.Rectangle([xMin, yMin, xMax, yMax])
+# Shows a Landsat median composite for the canvas extent and updates it
+# when the canvas moves.
+#
+# The extent is snapped to a grid of tiles, and the tile URL of each
+# composite is cached by (collection, date range, snapped bounds, vis
+# params). The layer is updated only after the canvas has stopped moving
+# for `debounce_ms`, and panning back to an area that was already viewed
+# doesn't make any Earth Engine requests.
+#
+# Run the script again to change the parameters. The cache is kept.
 
-dataset = ee.ImageCollection('LANDSAT/LC08/C02/T1_L2') \
-    .filter(ee.Filter.date('2021-01-01', '2022-01-01')) \
-    .filter(ee.Filter.bounds(geometry))
-
-image = dataset.median()
+ee.Initialize()
 
+collection_id = 'LANDSAT/LC08/C02/T1_L2'
+start_date = '2021-01-01'
+end_date = '2022-01-01'
 visParams = {
     'min':0,
     'max':10000,
     'bands': ['SR_B4', 'SR_B3', 'SR_B2']
 }
-Map.addLayer(image, visParams, 'Image')
+layer_name = 'Image'
+debounce_ms = 500
+# Tile URLs are requested again after this many seconds
+map_id_ttl = 3600
+max_cached = 256
+
+
+def snap_bounds(xMin, yMin, xMax, yMax):
+    """Snap bounds in degrees to a grid of tiles at the zoom level where
+    the extent is about one tile wide."""
+    width = max(xMax - xMin, yMax - yMin, 1e-6)
+    zoom = max(0, math.floor(math.log2(360 / width)))
+    size = 360 / 2 ** zoom
+    return (math.floor(xMin / size) * size, max(-90, math.floor(yMin / size) * size),
+            math.ceil(xMax / size) * size, min(90, math.ceil(yMax / size) * size))
+
+
+class CompositeUpdater(object):
+    """Updates the composite layer for the canvas extent."""
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        # key -> (tile url, time it was requested), least recently used first
+        self.cache = OrderedDict()
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.update)
+        self.canvas.extentsChanged.connect(self.schedule)
+
+    def close(self):
+        self.canvas.extentsChanged.disconnect(self.schedule)
+        self.timer.stop()
+
+    def schedule(self):
+        # Restarting the timer on every change waits for the canvas to stop
+        self.timer.start(debounce_ms)
+
+    def bounds(self):
+        extent = self.canvas.extent()
+        transform = QgsCoordinateTransform(
+            self.canvas.mapSettings().destinationCrs(),
+            QgsCoordinateReferenceSystem('EPSG:4326'), QgsProject.instance())
+        extent = transform.transformBoundingBox(extent)
+        return snap_bounds(extent.xMinimum(), extent.yMinimum(),
+                           extent.xMaximum(), extent.yMaximum())
+
+    def tile_url(self, bounds):
+        key = (collection_id, start_date, end_date, bounds,
+               json.dumps(visParams, sort_keys=True))
+        cached = self.cache.get(key)
+        if cached and time.time() - cached[1] < map_id_ttl:
+            self.cache.move_to_end(key)
+            return cached[0]
+        geometry = ee.Geometry.Rectangle(list(bounds))
+        dataset = ee.ImageCollection(collection_id) \
+            .filter(ee.Filter.date(start_date, end_date)) \
+            .filter(ee.Filter.bounds(geometry))
+        image = dataset.median()
+        url = image.getMapId(visParams)['tile_fetcher'].url_format
+        self.cache[key] = (url, time.time())
+        while len(self.cache) > max_cached:
+            self.cache.popitem(last=False)
+        return url
+
+    def update(self):
+        url = self.tile_url(self.bounds())
+        uri = 'type=xyz&url={}&zmin=0&zmax=20'.format(urllib.parse.quote(url))
+        layers = QgsProject.instance().mapLayersByName(layer_name)
+        if not layers:
+            QgsProject.instance().addMapLayer(QgsRasterLayer(uri, layer_name, 'wms'))
+        elif layers[0].source() != uri:
+            layers[0].setDataSource(uri, layer_name, 'wms')
+            layers[0].triggerRepaint()
+
+
+# The updater is kept on qgis.utils so the cache survives running the
+# script again
+updater = getattr(qgis.utils, 'ee_composite_updater', None)
+cache = updater.cache if updater else OrderedDict()
+if updater:
+    updater.close()
+updater = CompositeUpdater(iface.mapCanvas())
+updater.cache = cache
+qgis.utils.ee_composite_updater = updater
+updater.update()
@@ -1,10 +1,16 @@
 """Algorithm to calculate Zonal Statistics using GEE API
 
 This script uses CHIRPS data.
+
+Features are sent to GEE in batches. Each batch is a FeatureCollection
+reduced with a single reduceRegions() call, several batches are
+requested at the same time and the results are joined back to the
+input features by feature id.
 """
 import ee
 ee.Initialize()
 
+import concurrent.futures
 import json
 from PyQt5.QtCore import QCoreApplication, QVariant
 
@@ -18,6 +24,8 @@ class AnnualPrecipitation(QgsProcessingAlgorithm):
     """Calculates annual rainfall using GEE API for each input features"""
     INPUT = 'INPUT'
     YEAR = 'YEAR'
+    BATCH_SIZE = 'BATCH_SIZE'
+    CONCURRENCY = 'CONCURRENCY'
     OUTPUT = 'OUTPUT'
 
     
@@ -38,8 +46,25 @@ class AnnualPrecipitation(QgsProcessingAlgorithm):
                 2021, False, 1
             )
         )
-        
-        
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'BATCH_SIZE',
+                self.tr('Features per GEE request'),
+                QgsProcessingParameterNumber.Integer,
+                200, False, 1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'CONCURRENCY',
+                self.tr('Concurrent GEE requests'),
+                QgsProcessingParameterNumber.Integer,
+                4, False, 1, 32
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFeatureSink(
                 self.OUTPUT,
@@ -51,6 +76,8 @@ class AnnualPrecipitation(QgsProcessingAlgorithm):
     def processAlgorithm(self, parameters, context, feedback):
         source= self.parameterAsSource(parameters, self.INPUT, context)
         year = self.parameterAsInt(parameters, self.YEAR, context)
+        batch_size = self.parameterAsInt(parameters, self.BATCH_SIZE, context)
+        concurrency = self.parameterAsInt(parameters, self.CONCURRENCY, context)
         
         outputFields = source.fields()
         newFields = QgsFields()
@@ -75,36 +102,80 @@ class AnnualPrecipitation(QgsProcessingAlgorithm):
         filtered = chirps.filter(ee.Filter.date(startDate, endDate))
         total_precipitation = filtered.sum()
         
-        #features = [f for f in source.getFeatures()]
-        
         total_features = 100.0 / source.featureCount() if source.featureCount() else 0
 
-        for current, out_f in enumerate(source.getFeatures()):
-            # Stop the algorithm if cancel button has been clicked
-            if feedback.isCanceled():
-                break
-                  
-            geometry = out_f.geometry()
-            json_geometry = json.loads(geometry.asJson())['coordinates']
-            polygon = ee.Geometry.MultiPolygon(json_geometry)
-            stats = total_precipitation.reduceRegion(**{
-              'reducer': ee.Reducer.mean(),
-              'geometry': polygon,
-              'scale': 5000,
-              })
-            precipitation = stats.getNumber('precipitation').getInfo()
-            feedback.pushInfo(str(precipitation))
-            attributes = out_f.attributes()
-
-            attributes.append(year)
-            attributes.append(precipitation)
-
-            out_f.setAttributes(attributes)
-            sink.addFeature(out_f, QgsFeatureSink.FastInsert)
-            feedback.setProgress(int(current * total_features))
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        # Maps each in-flight request to the features of its batch
+        in_flight = {}
+        processed = 0
+        batch = {}
+        features = source.getFeatures()
+        exhausted = False
+        try:
+            while True:
+                # Keep up to `concurrency` batches in flight
+                while not exhausted and len(in_flight) < concurrency:
+                    if feedback.isCanceled():
+                        exhausted = True
+                        break
+                    f = next(features, None)
+                    if f is None:
+                        exhausted = True
+                    else:
+                        batch[f.id()] = f
+                    if batch and (exhausted or len(batch) >= batch_size):
+                        # Convert geometries here as QGIS objects should
+                        # not be used from the worker threads
+                        geometries = [(fid, json.loads(f.geometry().asJson()))
+                            for fid, f in batch.items()]
+                        future = executor.submit(
+                            self.reduceBatch, total_precipitation, geometries)
+                        in_flight[future] = batch
+                        batch = {}
+                if not in_flight:
+                    break
+                done, _ = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    batch_features = in_flight.pop(future)
+                    results = future.result()
+                    # Stop the algorithm if cancel button has been clicked
+                    if feedback.isCanceled():
+                        continue
+                    for fid, out_f in batch_features.items():
+                        attributes = out_f.attributes()
+                        attributes.append(year)
+                        attributes.append(results.get(fid))
+                        out_f.setAttributes(attributes)
+                        sink.addFeature(out_f, QgsFeatureSink.FastInsert)
+                    processed += len(batch_features)
+                    feedback.pushInfo(self.tr('Processed {} features').format(processed))
+                    feedback.setProgress(int(processed * total_features))
+        finally:
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=False)
 
         return {self.OUTPUT: sink} 
 
+    def reduceBatch(self, image, geometries):
+        """Returns a dictionary of feature id and mean precipitation
+        for a list of (feature id, GeoJSON geometry) pairs using a single
+        reduceRegions() call"""
+        ee_features = [ee.Feature(ee.Geometry(geometry), {'fid': fid})
+            for fid, geometry in geometries]
+        stats = image.reduceRegions(**{
+          'collection': ee.FeatureCollection(ee_features),
+          'reducer': ee.Reducer.mean().setOutputs(['precipitation']),
+          'scale': 5000,
+          })
+        stats = stats.select(['fid', 'precipitation'], retainGeometry=False)
+        results = {}
+        for feature in stats.getInfo()['features']:
+            properties = feature['properties']
+            results[properties['fid']] = properties.get('precipitation')
+        return results
+
     def name(self):
         return 'annual_precipitation_gee'
 
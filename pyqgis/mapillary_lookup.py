@@ -0,0 +1,165 @@
+"""Cached lookup of Mapillary images near a location
+
+Used by actions/mapillary_action.py and mapillary_prewarm.py.
+
+- Requests go through one requests.Session, so connections to the API
+  and the thumbnail servers are reused.
+- The image metadata found for a location (or the fact that there is
+  none) is cached in a SQLite file and thumbnails are saved as files in
+  the cache folder. Cached entries older than `ttl` seconds are fetched
+  again and can be deleted with evict().
+- Locations are rounded to 4 decimals (about 10 m), so clicks on the
+  same spot share a cache entry.
+- prewarm() fills the cache for many locations using a pool of threads.
+
+The module doesn't depend on QGIS. The API URL can be changed to point
+to a local server.
+
+API documentation: https://www.mapillary.com/developer/api-documentation#image
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+API_URL = 'https://graph.mapillary.com/images'
+# Default time to keep cached entries, 30 days
+TTL = 30 * 24 * 3600
+
+
+class MapillaryLookup(object):
+    """Finds the nearest Mapillary image thumbnail for a location."""
+
+    def __init__(self, access_token, cache_dir, ttl=TTL, api_url=API_URL,
+                 workers=8, timeout=10, size=0.001):
+        self.access_token = access_token
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.api_url = api_url
+        self.workers = workers
+        self.timeout = timeout
+        # Half width of the search box in degrees
+        self.size = size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.thumbnail_dir = os.path.join(cache_dir, 'thumbnails')
+        if not os.path.exists(self.thumbnail_dir):
+            os.makedirs(self.thumbnail_dir)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'metadata.sqlite'),
+                                  check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS images '
+                        '(key TEXT PRIMARY KEY, image TEXT, fetched REAL)')
+        self.db.commit()
+
+    def close(self):
+        self.session.close()
+        self.db.close()
+
+    def key(self, x, y):
+        return '{:.4f},{:.4f}'.format(x, y)
+
+    def cached(self, key):
+        """Return (found, image) from the metadata cache."""
+        with self.lock:
+            row = self.db.execute('SELECT image, fetched FROM images WHERE key = ?',
+                                  (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return False, None
+        return True, json.loads(row[0])
+
+    def image(self, x, y):
+        """Return the metadata of an image near x, y (in EPSG:4326) as a
+        dictionary with id and thumb_1024_url, or None if there is none."""
+        key = self.key(x, y)
+        found, image = self.cached(key)
+        if found:
+            return image
+        x, y = [float(value) for value in key.split(',')]
+        parameters = {
+            'access_token': self.access_token,
+            'bbox': '{},{},{},{}'.format(x - self.size, y - self.size,
+                                         x + self.size, y + self.size),
+            'fields': 'id,thumb_1024_url',
+            'limit': 1
+        }
+        response = self.session.get(self.api_url, params=parameters,
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()['data']
+        image = data[0] if data else None
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?)',
+                            (key, json.dumps(image), time.time()))
+            self.db.commit()
+        return image
+
+    def thumbnail_path(self, image):
+        name = image.get('id') or hashlib.sha1(
+            image['thumb_1024_url'].encode('utf-8')).hexdigest()
+        return os.path.join(self.thumbnail_dir, '{}.jpg'.format(name))
+
+    def thumbnail(self, x, y):
+        """Return the path of a local copy of the thumbnail of the image
+        near x, y, or None if there is no image."""
+        image = self.image(x, y)
+        if image is None:
+            return None
+        path = self.thumbnail_path(image)
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) <= self.ttl:
+            return path
+        response = self.session.get(image['thumb_1024_url'], timeout=self.timeout)
+        response.raise_for_status()
+        # Write to a temporary file so a partial download is never used
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temp_path, 'wb') as f:
+            f.write(response.content)
+        os.replace(temp_path, path)
+        return path
+
+    def prewarm(self, points, progress=None):
+        """Cache the thumbnails of all (x, y) points. Returns the number
+        of locations with an image. progress is called with the number of
+        locations done and stops when it returns False."""
+        # Points that share a cache entry are only requested once
+        locations = {}
+        for x, y in points:
+            locations.setdefault(self.key(x, y), (x, y))
+        found = 0
+        done = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.thumbnail, x, y)
+                       for x, y in locations.values()]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    done += 1
+                    try:
+                        if future.result():
+                            found += 1
+                    except requests.RequestException as error:
+                        print('Request failed: {}'.format(error))
+                    if progress is not None and progress(done) is False:
+                        break
+            finally:
+                for future in futures:
+                    future.cancel()
+        return found
+
+    def evict(self):
+        """Delete cached entries and thumbnails older than the TTL."""
+        expired = time.time() - self.ttl
+        with self.lock:
+            self.db.execute('DELETE FROM images WHERE fetched < ?', (expired,))
+            self.db.commit()
+        for entry in os.scandir(self.thumbnail_dir):
+            if entry.is_file() and entry.stat().st_mtime < expired:
+                os.remove(entry.path)
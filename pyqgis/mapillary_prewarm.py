@@ -0,0 +1,44 @@
+# Script to fill the Mapillary cache used by actions/mapillary_action.py
+# with the thumbnails near every feature of the active layer.
+# Clicking a feature afterwards shows its thumbnail from the cache.
+# Point layers use the point, other layers the centroid.
+
+# Script to be run from Python Console in QGIS
+import os
+import sys
+
+access_token = '<access token>'
+# Folder containing mapillary_lookup.py
+scripts_folder = os.path.expanduser('~/projects/pyqgis')
+# Must be the same as in the action
+cache_dir = os.path.join(os.path.expanduser('~'), '.mapillary_cache')
+workers = 8
+
+if scripts_folder not in sys.path:
+    sys.path.append(scripts_folder)
+from mapillary_lookup import MapillaryLookup
+
+layer = iface.activeLayer()
+transform = QgsCoordinateTransform(layer.crs(), QgsCoordinateReferenceSystem('EPSG:4326'),
+                                   QgsProject.instance())
+points = []
+for feature in layer.getFeatures():
+    if not feature.hasGeometry():
+        continue
+    point = transform.transform(feature.geometry().centroid().asPoint())
+    points.append((point.x(), point.y()))
+
+if not os.path.exists(cache_dir):
+    os.makedirs(cache_dir)
+lookup = MapillaryLookup(access_token, cache_dir, workers=workers)
+lookup.evict()
+
+
+def progress(done):
+    if done % 100 == 0:
+        print('Processed {} of {} features'.format(done, len(points)))
+
+
+found = lookup.prewarm(points, progress)
+lookup.close()
+print('Cached thumbnails for {} locations near {} features'.format(found, len(points)))
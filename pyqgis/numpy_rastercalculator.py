@@ -0,0 +1,232 @@
+"""Processing Script to evaluate a NumPy expression over raster layers
+
+The input layers are available in the expression as A, B, C, ... in the
+order they are selected, together with np for NumPy functions. For
+example (A - B) / (A + B).
+
+The rasters are processed block by block following the internal tiling
+of the first input (or in strips of rows for striped files), so memory
+use doesn't grow with the raster size. The output uses the same layout.
+Blocks are read and computed in a pool of threads, each with its own
+GDAL datasets, and written to a GeoTIFF by the main thread as
+they complete. Only a few blocks per thread are in flight at a time.
+
+All inputs must have the same size and geotransform. Pixels where any
+input is nodata are set to the output nodata value.
+"""
+import concurrent.futures
+import string
+import threading
+import numpy as np
+from osgeo import gdal
+from qgis.core import (QgsProcessing,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterMultipleLayers,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterRasterDestination)
+
+OUTPUT_NODATA = -9999
+
+
+def open_raster(path):
+    # Return values are checked instead of calling gdal.UseExceptions(),
+    # which would change GDAL error handling for all of QGIS
+    dataset = gdal.Open(path)
+    if dataset is None:
+        raise ValueError('Cannot open {}: {}'.format(path, gdal.GetLastErrorMsg()))
+    return dataset
+
+
+def block_layout(dataset, max_pixels=1 << 20):
+    """Return (block_x, block_y, tiled) for processing `dataset`.
+
+    Tiled files are processed tile by tile. Striped files, or files with
+    tiles that GeoTIFF can't write, are processed in strips of full rows
+    of about max_pixels pixels.
+    """
+    block_x, block_y = dataset.GetRasterBand(1).GetBlockSize()
+    if block_x < dataset.RasterXSize and block_x % 16 == 0 and block_y % 16 == 0:
+        return block_x, block_y, True
+    rows = max(1, max_pixels // dataset.RasterXSize)
+    return dataset.RasterXSize, min(rows, dataset.RasterYSize), False
+
+
+def block_windows(dataset, block_x, block_y):
+    """Yield (xoff, yoff, xsize, ysize) windows of block_x by block_y."""
+    for yoff in range(0, dataset.RasterYSize, block_y):
+        ysize = min(block_y, dataset.RasterYSize - yoff)
+        for xoff in range(0, dataset.RasterXSize, block_x):
+            xsize = min(block_x, dataset.RasterXSize - xoff)
+            yield xoff, yoff, xsize, ysize
+
+
+def calculate(inputs, expression, output, threads=4, nodata=OUTPUT_NODATA,
+              progress=None):
+    """Evaluate `expression` over the first band of each input raster and
+    write a Float32 GeoTIFF to `output`.
+
+    progress is called with the fraction of blocks done and stops the
+    calculation when it returns False.
+    """
+    names = list(string.ascii_uppercase[:len(inputs)])
+    code = compile(expression, '<expression>', 'eval')
+
+    first = open_raster(inputs[0])
+    for path in inputs[1:]:
+        dataset = open_raster(path)
+        if (dataset.RasterXSize, dataset.RasterYSize) != (first.RasterXSize, first.RasterYSize) \
+                or dataset.GetGeoTransform() != first.GetGeoTransform():
+            raise ValueError('{} does not match the size and geotransform of {}'.format(
+                path, inputs[0]))
+    # The output has the same layout, so each output block is written once
+    block_x, block_y, tiled = block_layout(first)
+    windows = list(block_windows(first, block_x, block_y))
+    if tiled:
+        layout = ['TILED=YES', 'BLOCKXSIZE={}'.format(block_x),
+                  'BLOCKYSIZE={}'.format(block_y)]
+    else:
+        layout = ['BLOCKYSIZE={}'.format(block_y)]
+    driver = gdal.GetDriverByName('GTiff')
+    target = driver.Create(output, first.RasterXSize, first.RasterYSize, 1, gdal.GDT_Float32,
+                           options=layout + ['COMPRESS=DEFLATE', 'PREDICTOR=3',
+                                             'BIGTIFF=IF_SAFER'])
+    if target is None:
+        raise ValueError('Cannot create {}: {}'.format(output, gdal.GetLastErrorMsg()))
+    target.SetGeoTransform(first.GetGeoTransform())
+    target.SetProjection(first.GetProjection())
+    out_band = target.GetRasterBand(1)
+    out_band.SetNoDataValue(nodata)
+    first = None
+
+    # GDAL datasets can't be shared between threads
+    local = threading.local()
+
+    def compute(window):
+        if not hasattr(local, 'bands'):
+            local.datasets = [open_raster(path) for path in inputs]
+            local.bands = [dataset.GetRasterBand(1) for dataset in local.datasets]
+        xoff, yoff, xsize, ysize = window
+        variables = {'np': np}
+        mask = np.zeros((ysize, xsize), dtype=bool)
+        for name, band in zip(names, local.bands):
+            values = band.ReadAsArray(xoff, yoff, xsize, ysize)
+            if values is None:
+                raise RuntimeError('Failed to read block at {}, {}: {}'.format(
+                    xoff, yoff, gdal.GetLastErrorMsg()))
+            values = values.astype('float32')
+            band_nodata = band.GetNoDataValue()
+            if band_nodata is not None:
+                mask |= values == band_nodata
+            variables[name] = values
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = eval(code, {'__builtins__': {}}, variables)
+        result = np.broadcast_to(np.asarray(result, dtype='float32'), (ysize, xsize))
+        result = np.where(mask | ~np.isfinite(result), nodata, result)
+        return window, result.astype('float32')
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    max_in_flight = threads * 2
+    in_flight = set()
+    pending = iter(windows)
+    done_count = 0
+    cancelled = False
+    try:
+        while True:
+            while not cancelled and len(in_flight) < max_in_flight:
+                window = next(pending, None)
+                if window is None:
+                    break
+                in_flight.add(executor.submit(compute, window))
+            if not in_flight:
+                break
+            done, in_flight = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                (xoff, yoff, _, _), result = future.result()
+                if out_band.WriteArray(result, xoff, yoff) != gdal.CE_None:
+                    raise RuntimeError('Failed to write block at {}, {}: {}'.format(
+                        xoff, yoff, gdal.GetLastErrorMsg()))
+                done_count += 1
+            if progress is not None and progress(done_count / len(windows)) is False:
+                cancelled = True
+    finally:
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=True)
+        out_band = None
+        target = None
+    return not cancelled
+
+
+class NumpyRasterCalculatorAlgorithm(QgsProcessingAlgorithm):
+    INPUTS = 'INPUTS'
+    EXPRESSION = 'EXPRESSION'
+    THREADS = 'THREADS'
+    OUTPUT = 'OUTPUT'
+
+    def createInstance(self):
+        return NumpyRasterCalculatorAlgorithm()
+
+    def name(self):
+        return 'numpyrastercalculator'
+
+    def displayName(self):
+        return 'NumPy Raster Calculator'
+
+    def shortHelpString(self):
+        return ('Evaluates a NumPy expression block by block. The input layers are '
+                'named A, B, C, ... in the order they are selected, e.g. (A - B) / (A + B)')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.INPUTS, 'Input rasters', QgsProcessing.TypeRaster
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.EXPRESSION, 'Expression', defaultValue='A'
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.THREADS, 'Number of threads',
+                QgsProcessingParameterNumber.Integer, 4, False, 1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                  self.OUTPUT, 'OUTPUT'
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        layers = self.parameterAsLayerList(parameters, self.INPUTS, context)
+        expression = self.parameterAsString(parameters, self.EXPRESSION, context)
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        output = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+        if not layers:
+            raise QgsProcessingException('Select at least one input raster')
+        if len(layers) > len(string.ascii_uppercase):
+            raise QgsProcessingException('Too many input rasters')
+
+        for name, layer in zip(string.ascii_uppercase, layers):
+            feedback.pushInfo('{} = {}'.format(name, layer.name()))
+
+        def progress(fraction):
+            feedback.setProgress(fraction * 100)
+            return not feedback.isCanceled()
+
+        try:
+            calculate([layer.source() for layer in layers], expression, output,
+                      threads=threads, progress=progress)
+        except (SyntaxError, NameError, AttributeError, IndexError, TypeError, ValueError,
+                RuntimeError) as error:
+            # e.g. an expression with arrays of different shapes
+            raise QgsProcessingException('{}: {}'.format(type(error).__name__, error))
+        return {self.OUTPUT: output}
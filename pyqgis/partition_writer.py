@@ -0,0 +1,107 @@
+# Helpers for split_layer.py to write partitions of a layer to GeoPackage
+# files in worker processes.
+#
+# The workers only use GDAL/OGR, so they can run outside of the QGIS
+# application. Features are passed to them as WKB geometry and a list of
+# plain Python attribute values.
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+from osgeo import gdal, ogr, osr
+
+# Number of features written per transaction
+BATCH_SIZE = 10000
+
+
+def python_executable():
+    # Inside QGIS sys.executable is the QGIS application, not Python,
+    # so worker processes are started with the bundled interpreter
+    if os.name == 'nt':
+        candidate = os.path.join(sys.exec_prefix, 'python.exe')
+    else:
+        candidate = os.path.join(sys.exec_prefix, 'bin', 'python3')
+    return candidate if os.path.exists(candidate) else sys.executable
+
+
+def check(result, message):
+    # Return values are checked instead of calling gdal.UseExceptions(),
+    # which would change GDAL error handling for all of QGIS
+    if result is None or (isinstance(result, int) and result != ogr.OGRERR_NONE):
+        raise RuntimeError('{}: {}'.format(message, gdal.GetLastErrorMsg()))
+    return result
+
+
+def write_partition(path, layer_name, srs_wkt, geometry_type, fields, features,
+                    batch_size=BATCH_SIZE):
+    """Write features to a new GeoPackage at `path`.
+
+    fields is a list of (name, ogr field type) and features a list of
+    (wkb, attributes). Features are written in transactions of
+    batch_size. The file is written under a temporary name and moved
+    in place when complete.
+    """
+    folder, filename = os.path.split(path)
+    temp_path = os.path.join(folder, '~' + filename)
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    driver = ogr.GetDriverByName('GPKG')
+    dataset = check(driver.CreateDataSource(temp_path), 'Cannot create ' + temp_path)
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(srs_wkt)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    layer = check(dataset.CreateLayer(layer_name, srs, geometry_type),
+                  'Cannot create layer ' + layer_name)
+    for name, field_type in fields:
+        check(layer.CreateField(ogr.FieldDefn(name, field_type)),
+              'Cannot create field ' + name)
+    definition = layer.GetLayerDefn()
+
+    layer.StartTransaction()
+    for i, (wkb, attributes) in enumerate(features):
+        feature = ogr.Feature(definition)
+        if wkb:
+            feature.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+        for j, value in enumerate(attributes):
+            if value is not None:
+                feature.SetField(j, value)
+        check(layer.CreateFeature(feature), 'Cannot write feature')
+        if (i + 1) % batch_size == 0:
+            check(layer.CommitTransaction(), 'Cannot commit')
+            layer.StartTransaction()
+    check(layer.CommitTransaction(), 'Cannot commit')
+    dataset = None
+    os.replace(temp_path, path)
+    return path, len(features)
+
+
+def write_partitions(partitions, srs_wkt, geometry_type, fields, workers=None,
+                     batch_size=BATCH_SIZE):
+    """Write each (path, layer_name, features) partition, yielding
+    (path, count, error) as they complete.
+
+    With workers=0 the partitions are written in the current process.
+    """
+    if workers == 0:
+        for path, layer_name, features in partitions:
+            try:
+                yield write_partition(path, layer_name, srs_wkt, geometry_type,
+                                      fields, features, batch_size) + (None,)
+            except Exception as error:
+                yield path, 0, error
+        return
+
+    context = multiprocessing.get_context('spawn')
+    context.set_executable(python_executable())
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=context) as executor:
+        futures = {}
+        for path, layer_name, features in partitions:
+            future = executor.submit(write_partition, path, layer_name, srs_wkt,
+                                     geometry_type, fields, features, batch_size)
+            futures[future] = path
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield future.result() + (None,)
+            except Exception as error:
+                yield futures[future], 0, error
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import numpy as np
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsFeatureSink,
+                       QgsFeatureRequest,
+                       QgsFields,
+                       QgsField,
+                       QgsGeometry,
+                       QgsSpatialIndex,
+                       QgsCoordinateTransform,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingUtils,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterField,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink)
+
+
+class ReverseGeocode(QgsProcessingAlgorithm):
+    """
+    This algorithm reverse geocodes a point layer using a street network
+    with address ranges on each side of the street.
+
+    It is the batch version of the actions/reverse_geocode_street.py
+    action. The street index is built once. Side of street and the
+    interpolated address are computed for batches of points with NumPy.
+    """
+
+    INPUT = 'INPUT'
+    STREETS = 'STREETS'
+    STREET_NAME = 'STREET_NAME'
+    LEFT_FROM = 'LEFT_FROM'
+    LEFT_TO = 'LEFT_TO'
+    RIGHT_FROM = 'RIGHT_FROM'
+    RIGHT_TO = 'RIGHT_TO'
+    CANDIDATES = 'CANDIDATES'
+    MAX_DISTANCE = 'MAX_DISTANCE'
+    OUTPUT = 'OUTPUT'
+
+    # Number of points matched before their addresses are computed
+    BATCH_SIZE = 10000
+
+    def tr(self, string):
+
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ReverseGeocode()
+
+    def name(self):
+        return 'reversegeocode'
+
+    def displayName(self):
+        return self.tr('Reverse Geocode')
+
+    def group(self):
+        return self.tr('')
+
+    def groupId(self):
+        return ''
+
+    def shortHelpString(self):
+        return self.tr("Find the address of each point by interpolating the "
+                       "address range of the nearest street on the side of "
+                       "the street the point is on")
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT,
+                self.tr('Point layer'),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.STREETS,
+                self.tr('Street layer'),
+                [QgsProcessing.TypeVectorLine]
+            )
+        )
+
+        for name, description, default in [
+                (self.STREET_NAME, 'Street name field', 'NAME'),
+                (self.LEFT_FROM, 'Left side from address field', 'L_F_ADD'),
+                (self.LEFT_TO, 'Left side to address field', 'L_T_ADD'),
+                (self.RIGHT_FROM, 'Right side from address field', 'R_F_ADD'),
+                (self.RIGHT_TO, 'Right side to address field', 'R_T_ADD')]:
+            self.addParameter(
+                QgsProcessingParameterField(
+                    name,
+                    self.tr(description),
+                    default,
+                    self.STREETS
+                )
+            )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CANDIDATES,
+                self.tr('Number of nearest streets to compare'),
+                QgsProcessingParameterNumber.Integer,
+                5, False, 1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_DISTANCE,
+                self.tr('Maximum distance to a street (0 for no limit)'),
+                QgsProcessingParameterNumber.Double,
+                0, False, 0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Reverse geocoded'),
+                QgsProcessing.TypeVectorPoint
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        streets = self.parameterAsSource(parameters, self.STREETS, context)
+        if streets is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.STREETS))
+        street_fields = [self.parameterAsString(parameters, name, context)
+                         for name in [self.STREET_NAME, self.LEFT_FROM, self.LEFT_TO,
+                                      self.RIGHT_FROM, self.RIGHT_TO]]
+        candidates = self.parameterAsInt(parameters, self.CANDIDATES, context)
+        max_distance = self.parameterAsDouble(parameters, self.MAX_DISTANCE, context)
+
+        newFields = QgsFields()
+        newFields.append(QgsField('address', QVariant.String))
+        newFields.append(QgsField('street', QVariant.String))
+        newFields.append(QgsField('street_num', QVariant.Int))
+        newFields.append(QgsField('side', QVariant.String))
+        newFields.append(QgsField('distance', QVariant.Double))
+        outputFields = QgsProcessingUtils.combineFields(source.fields(), newFields)
+        sink, dest_id = self.parameterAsSink(
+            parameters,
+            self.OUTPUT,
+            context,
+            outputFields,
+            source.wkbType(),
+            source.sourceCrs()
+        )
+
+        index, street_attributes = self.buildIndex(streets, street_fields, feedback)
+        # Points are matched in the CRS of the streets
+        transform = QgsCoordinateTransform(
+            source.sourceCrs(), streets.sourceCrs(), context.transformContext())
+
+        total = 100.0 / source.featureCount() if source.featureCount() else 0
+        batch = []
+        for current, feature in enumerate(source.getFeatures()):
+            if feedback.isCanceled():
+                break
+            batch.append(feature)
+            if len(batch) >= self.BATCH_SIZE:
+                self.geocodeBatch(batch, index, street_attributes, transform,
+                                  candidates, max_distance, sink)
+                batch = []
+            feedback.setProgress(int((current + 1) * total))
+        if batch and not feedback.isCanceled():
+            self.geocodeBatch(batch, index, street_attributes, transform,
+                              candidates, max_distance, sink)
+
+        return {self.OUTPUT: dest_id}
+
+    def buildIndex(self, streets, street_fields, feedback):
+        """Index the streets once, keeping their geometries in the index
+        and the address attributes in a dictionary by feature id."""
+        feedback.pushInfo(self.tr('Building street index'))
+        request = QgsFeatureRequest()
+        request.setSubsetOfAttributes(street_fields, streets.fields())
+        index = QgsSpatialIndex(flags=QgsSpatialIndex.FlagStoreFeatureGeometries)
+        street_attributes = {}
+        for street in streets.getFeatures(request):
+            if feedback.isCanceled():
+                break
+            if not street.hasGeometry():
+                continue
+            index.addFeature(street)
+            name = street[street_fields[0]]
+            ranges = [self.toNumber(street[field]) for field in street_fields[1:]]
+            street_attributes[street.id()] = [name] + ranges
+        return index, street_attributes
+
+    def toNumber(self, value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+
+    def geocodeBatch(self, batch, index, street_attributes, transform,
+                     candidates, max_distance, sink):
+        # Length of each candidate street, computed once per street
+        lengths = {}
+        n = len(batch)
+        street_ids = [None] * n
+        distances = np.full(n, np.nan)
+        fractions = np.full(n, np.nan)
+        left = np.zeros(n, dtype=bool)
+
+        for i, feature in enumerate(batch):
+            if not feature.hasGeometry():
+                continue
+            geometry = QgsGeometry(feature.geometry())
+            geometry.transform(transform)
+            # asPoint() raises on MultiPoint layers, which are matched
+            # at the centroid of their parts
+            if geometry.isMultipart():
+                geometry = geometry.centroid()
+            point = geometry.asPoint()
+            nearest = None
+            for fid in index.nearestNeighbor(point, candidates, max_distance):
+                street = index.geometry(fid)
+                # A single call returns the distance, the closest point
+                # and the side of the street
+                sqr_distance, closest, _, left_of = street.closestSegmentWithContext(point)
+                if nearest is None or sqr_distance < nearest[0]:
+                    nearest = (sqr_distance, fid, street, closest, left_of)
+            if nearest is None:
+                continue
+            sqr_distance, fid, street, closest, left_of = nearest
+            if fid not in lengths:
+                lengths[fid] = street.length()
+            street_ids[i] = fid
+            distances[i] = np.sqrt(sqr_distance)
+            left[i] = left_of < 0
+            if lengths[fid] > 0:
+                along = street.lineLocatePoint(QgsGeometry.fromPointXY(closest))
+                fractions[i] = along / lengths[fid]
+
+        # Interpolate the address on the side of the street for all points
+        ranges = np.array([street_attributes[fid][1:] if fid is not None else [np.nan] * 4
+                           for fid in street_ids], dtype=float).reshape(n, 4)
+        from_add = np.where(left, ranges[:, 0], ranges[:, 2])
+        to_add = np.where(left, ranges[:, 1], ranges[:, 3])
+        interpolated = from_add + (to_add - from_add) * fractions
+        valid = ~np.isnan(interpolated)
+        rounded = np.ceil(np.where(valid, interpolated, 0)).astype('int64')
+        # Odd numbers on the left side, even numbers on the right side
+        streetnum = rounded + np.where(left, 1 - rounded % 2, rounded % 2)
+
+        for i, feature in enumerate(batch):
+            attributes = feature.attributes()
+            fid = street_ids[i]
+            if fid is None:
+                attributes.extend([None] * 5)
+            else:
+                street_name = street_attributes[fid][0]
+                side = 'Left' if left[i] else 'Right'
+                if valid[i]:
+                    number = int(streetnum[i])
+                    address = '{}, {}'.format(number, street_name)
+                else:
+                    number = None
+                    address = None
+                attributes.extend([address, street_name, number, side,
+                                   float(distances[i])])
+            feature.setAttributes(attributes)
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
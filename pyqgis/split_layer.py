@@ -1,13 +1,30 @@
 # A PyQGIS script to split a layer into multiple GeoPackage files based on Admin2 and Admin3 fields.
 # This script assumes that the active layer in QGIS has fields named 'Admin2' and 'Admin3'.
-# It creates a folder structure based on Admin2 values and saves each Admin3 feature as a separate GeoPackage file.
+# It creates a folder structure based on Admin2 values and saves each Admin3 unit as a separate GeoPackage file.
+# All features with the same Admin2 and Admin3 values are written to the same file.
+#
+# The layer is read once and the features are grouped by the partition
+# fields. Each GeoPackage is then written with GDAL in batched
+# transactions, with partitions spread over worker processes.
+# See partition_writer.py, which must be in the same folder as this script.
 
 # Script to be run from Python Console in QGIS
 # Tested on dataset ka_admin_boundaries.gpkg
 import os
+import sys
+import time
+from osgeo import ogr
+
+# Folder containing partition_writer.py
+if '__file__' in globals():
+    scripts_folder = os.path.dirname(os.path.abspath(__file__))
+else:
+    scripts_folder = os.path.expanduser('~/projects/pyqgis')
+if scripts_folder not in sys.path:
+    sys.path.append(scripts_folder)
+from partition_writer import write_partitions
 
 layer = iface.activeLayer()
-field_names = [field.name() for field in layer.fields()]
 
 admin2_field = 'Admin2'
 admin3_field = 'Admin3'
@@ -15,27 +32,73 @@ admin3_field = 'Admin3'
 # Relative path to the root folder where GeoPackage files will be saved
 root_folder = 'admin_boundaries'
 
+# Number of worker processes. Set to 0 to write in the QGIS process.
+workers = os.cpu_count()
+
+# OGR field types for QGIS field types, other types are written as text
+field_types = {
+    QVariant.Int: ogr.OFTInteger,
+    QVariant.UInt: ogr.OFTInteger64,
+    QVariant.LongLong: ogr.OFTInteger64,
+    QVariant.ULongLong: ogr.OFTInteger64,
+    QVariant.Double: ogr.OFTReal,
+    QVariant.Date: ogr.OFTDate,
+    QVariant.DateTime: ogr.OFTDateTime,
+    QVariant.Time: ogr.OFTTime,
+}
+fields = [(field.name(), field_types.get(field.type(), ogr.OFTString))
+          for field in layer.fields()]
+
+
+def ogr_geometry_type(wkb_type):
+    # QGIS uses the ISO codes for Z and M types (e.g. 1001 for PointZ)
+    # while OGR also has its own 2.5D codes, so the flat type and the
+    # Z/M flags are mapped separately
+    return ogr.GT_SetModifier(int(QgsWkbTypes.flatType(wkb_type)),
+                              QgsWkbTypes.hasZ(wkb_type),
+                              QgsWkbTypes.hasM(wkb_type))
+
+
+def to_python(value):
+    # Convert values to plain Python types that can be sent to workers
+    if value is None or value == NULL:
+        return None
+    if isinstance(value, (QDate, QDateTime, QTime)):
+        return value.toString(Qt.ISODate)
+    if isinstance(value, (int, float)):
+        return value
+    return str(value)
+
+
+start = time.perf_counter()
+partitions = {}
 for feature in layer.getFeatures():
-    admin2 = feature[admin2_field]
-    admin3 = feature[admin3_field]
+    key = (str(feature[admin2_field]), str(feature[admin3_field]))
+    geometry = feature.geometry()
+    wkb = bytes(geometry.asWkb()) if not geometry.isNull() else None
+    attributes = [to_python(value) for value in feature.attributes()]
+    partitions.setdefault(key, []).append((wkb, attributes))
+print(f'Read {layer.featureCount()} features into {len(partitions)} partitions '
+      f'in {time.perf_counter() - start:.1f}s')
+
+jobs = []
+for (admin2, admin3), features in partitions.items():
     # Create Admin2 folder
-    admin2_folder = os.path.join(root_folder, str(admin2))
+    admin2_folder = os.path.join(root_folder, admin2)
     if not os.path.exists(admin2_folder):
         os.makedirs(admin2_folder)
         print(f"Created Admin2 folder: {admin2_folder}")
-    # Create GeoPackage filename
-    gpkg_filename = f"{admin3}.gpkg"
-    gpkg_path = os.path.join(admin2_folder, gpkg_filename)
-    print(gpkg_path)
-    feature_id = feature.id()
-    new_layer = layer.materialize(
-        QgsFeatureRequest().setFilterFids([feature_id]))
-    
-    options = QgsVectorFileWriter.SaveVectorOptions()
-    options.layerName = f'{admin3}'
-    QgsVectorFileWriter.writeAsVectorFormat(
-        new_layer, 
-        gpkg_path, 
-        options
-    )
-    print(f'Created {gpkg_path}')
+    gpkg_path = os.path.join(admin2_folder, f"{admin3}.gpkg")
+    jobs.append((gpkg_path, admin3, features))
+
+results = write_partitions(jobs, layer.crs().toWkt(), ogr_geometry_type(layer.wkbType()),
+                           fields, workers=workers)
+failed = 0
+for gpkg_path, count, error in results:
+    if error:
+        failed += 1
+        print(f'Failed to create {gpkg_path}: {error}')
+    else:
+        print(f'Created {gpkg_path} with {count} features')
+print(f'Wrote {len(jobs) - failed} of {len(jobs)} files '
+      f'in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,140 @@
+"""Tests for mapillary_lookup.py against a local stand-in for the
+Mapillary API and thumbnail server.
+
+Run with: python -m pytest test_mapillary_lookup.py
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from mapillary_lookup import MapillaryLookup
+
+THUMBNAIL = b'\xff\xd8 fake jpeg \xff\xd9'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves /images like the Graph API, with one image east of
+    longitude 0 and none west of it, and /thumbnails/<id>.jpg."""
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        self.server.paths.append(url.path)
+        if url.path == '/images':
+            query = urllib.parse.parse_qs(url.query)
+            x_min = float(query['bbox'][0].split(',')[0])
+            data = []
+            if x_min >= 0:
+                image_id = '{:.4f}'.format(x_min)
+                data = [{'id': image_id, 'thumb_1024_url': 'http://{}:{}/thumbnails/{}.jpg'.format(
+                    *self.server.server_address, image_id)}]
+            body = json.dumps({'data': data}).encode('utf-8')
+        elif url.path.startswith('/thumbnails/'):
+            body = THUMBNAIL
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MapillaryLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.paths = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.api_url = 'http://{}:{}/images'.format(*self.server.server_address)
+        self.cache_dir = tempfile.mkdtemp()
+        self.lookup = self.new_lookup()
+
+    def tearDown(self):
+        self.lookup.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def new_lookup(self, **kwargs):
+        return MapillaryLookup('token', self.cache_dir, api_url=self.api_url, **kwargs)
+
+    def requests(self, path):
+        return sum(1 for p in self.server.paths if p.startswith(path))
+
+    def age_cache(self, seconds):
+        """Make every cached entry `seconds` older."""
+        with self.lookup.lock:
+            self.lookup.db.execute('UPDATE images SET fetched = fetched - ?', (seconds,))
+            self.lookup.db.commit()
+        for entry in os.scandir(self.lookup.thumbnail_dir):
+            stat = entry.stat()
+            os.utime(entry.path, (stat.st_atime - seconds, stat.st_mtime - seconds))
+
+    def test_cache_hit(self):
+        path = self.lookup.thumbnail(77.5946, 12.9716)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), THUMBNAIL)
+        self.assertEqual(self.lookup.thumbnail(77.59461, 12.97161), path)
+        # The cache is kept on disk for the next session
+        lookup = self.new_lookup()
+        self.assertEqual(lookup.thumbnail(77.5946, 12.9716), path)
+        lookup.close()
+        self.assertEqual(self.requests('/images'), 1)
+        self.assertEqual(self.requests('/thumbnails/'), 1)
+
+    def test_no_image_is_cached(self):
+        self.assertIsNone(self.lookup.thumbnail(-1.5, 52.0))
+        self.assertIsNone(self.lookup.thumbnail(-1.5, 52.0))
+        self.assertEqual(self.requests('/images'), 1)
+
+    def test_ttl_expiry(self):
+        self.lookup.ttl = 60
+        self.lookup.thumbnail(77.5946, 12.9716)
+        self.age_cache(30)
+        self.lookup.thumbnail(77.5946, 12.9716)
+        self.assertEqual(len(self.server.paths), 2)
+        self.age_cache(60)
+        self.lookup.thumbnail(77.5946, 12.9716)
+        self.assertEqual(self.requests('/images'), 2)
+        self.assertEqual(self.requests('/thumbnails/'), 2)
+
+    def test_evict(self):
+        self.lookup.ttl = 60
+        old = self.lookup.thumbnail(77.5946, 12.9716)
+        self.lookup.thumbnail(-1.5, 52.0)
+        self.age_cache(120)
+        new = self.lookup.thumbnail(10.0, 50.0)
+        self.lookup.evict()
+        keys = [row[0] for row in self.lookup.db.execute('SELECT key FROM images')]
+        self.assertEqual(keys, [self.lookup.key(10.0, 50.0)])
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_prewarm_deduplicates(self):
+        points = [(77.5946, 12.9716), (77.59461, 12.97159), (77.6, 13.0),
+                  (-1.5, 52.0), (-1.50001, 52.0)]
+        self.assertEqual(self.lookup.prewarm(points), 2)
+        self.assertEqual(self.requests('/images'), 3)
+        self.assertEqual(self.requests('/thumbnails/'), 2)
+        # Everything is served from the cache afterwards
+        for x, y in points:
+            self.lookup.thumbnail(x, y)
+        self.assertEqual(len(self.server.paths), 5)
+
+    def test_prewarm_stops_on_progress(self):
+        points = [(i / 10, 10.0) for i in range(50)]
+        lookup = self.new_lookup(workers=1)
+        lookup.prewarm(points, progress=lambda done: done < 5)
+        lookup.close()
+        self.assertLess(self.requests('/images'), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()